@@ -0,0 +1,169 @@
+# applications.py
+#
+# Job applications from /business apply and their review. Only pending
+# applications are kept in APPLICATIONS_FILE (looked up through its
+# business_id index); approving, denying or expiring one moves it to
+# APPLICATION_ARCHIVE_FILE, which is appended to and never loaded, so the
+# working set is just what owners still have to look at. Both files belong to
+# the server's own economy.
+#
+# A hire changes three collections, each written back on its own. Approved
+# applications are saved as 'hiring', with the employee entry they add,
+# before the business and the applicant are; finish_hires() completes any
+# left that way by a crash when the bot starts.
+
+import asyncio
+from datetime import datetime, timedelta
+import bank
+from storage import get_store, get_user_data, update_users, archive, known_partitions, borrow
+from config import ECONOMY_FILE, APPLICATIONS_FILE, BUSINESS_FILE, APPLICATION_ARCHIVE_FILE, APPLICATION_EXPIRY_DAYS
+
+class ReviewError(Exception):
+    pass
+
+# Pending applications to a business, oldest first.
+async def pending_applications(business_id, guild_id=None):
+    applications = await get_store(APPLICATIONS_FILE, guild_id)
+    found = [app for app in await applications.find('business_id', business_id) if app['status'] == 'pending']
+    found.sort(key=lambda app: app['applied_at'])
+    return found
+
+def _resolve(app, status, note=None):
+    app['status'] = status
+    app['resolved_at'] = datetime.now().isoformat()
+    if note:
+        app['note'] = note
+    return app
+
+# Approves or denies the given applications to the owner's business in one
+# go, with the business and every applicant locked together. Approvals are
+# taken oldest first; ones that no longer fit under max_employees stay
+# pending. Returns the (approved, denied, still pending) applications.
+async def review_applications(owner_id, business_id, app_ids, approve, guild_id=None):
+    applications = await get_store(APPLICATIONS_FILE, guild_id)
+    businesses = await get_store(BUSINESS_FILE, guild_id)
+    applicant_ids = set()
+    for app_id in app_ids:
+        app = await applications.get(app_id)
+        if app:
+            applicant_ids.add(app['applicant_id'])
+    async with bank.locked(users=applicant_ids, businesses=[business_id]):
+        business = await businesses.get(business_id)
+        if not business or business['owner_id'] != owner_id:
+            raise ReviewError("You don't own this business.")
+        # Read again under the locks: another review may have got there first.
+        selected = []
+        for app_id in app_ids:
+            app = await applications.get(app_id)
+            if app and app['business_id'] == business_id and app['status'] == 'pending':
+                selected.append(app)
+        selected.sort(key=lambda app: app['applied_at'])
+        approved, denied, left = [], [], []
+        hires = []
+        for app in selected:
+            applicant_id = str(app['applicant_id'])
+            if not approve:
+                denied.append(_resolve(app, 'denied'))
+                continue
+            user_data = await get_user_data(applicant_id, guild_id)
+            if applicant_id in business['employees']:
+                denied.append(_resolve(app, 'denied', 'already works here'))
+            elif user_data['business_job']:
+                denied.append(_resolve(app, 'denied', 'already works at another business'))
+            elif len(business['employees']) >= business['max_employees']:
+                left.append(app)
+            else:
+                app['hire'] = {
+                    'name': app['applicant_name'],
+                    'hired_at': datetime.now().isoformat(),
+                    'total_work_sessions': 0
+                }
+                _hire(business, user_data, app)
+                hires.append((applicant_id, user_data))
+                approved.append(app)
+        if hires:
+            # Every write is on disk before the locks go, so a hire is never
+            # half done while someone else can see it (or fire the employee).
+            await applications.put_many([(app['id'], {**app, 'status': 'hiring'}) for app in approved])
+            await applications.flush()
+            await businesses.put(business_id, business)
+            await update_users(hires, guild_id)
+            await businesses.flush()
+            await (await get_store(ECONOMY_FILE, guild_id)).flush()
+        for app in approved:
+            _resolve(app, 'approved')
+        resolved = approved + denied
+        # Archived first: a crash before the deletes are written back archives
+        # a hire twice rather than not at all.
+        await archive(APPLICATION_ARCHIVE_FILE, resolved, guild_id)
+        for app in resolved:
+            await applications.delete(app['id'])
+        await applications.flush()
+    return approved, denied, left
+
+# Adds the applicant of `app` to the business. Writing it again changes
+# nothing.
+def _hire(business, user_data, app):
+    applicant_id = str(app['applicant_id'])
+    if applicant_id not in business['employees']:
+        business['employees'][applicant_id] = app['hire']
+        business['total_employees_hired'] += 1
+    user_data['business_job'] = {'business_id': app['business_id']}
+
+# Completes the hires a crash left as 'hiring' applications, whichever of
+# their writes made it to disk. Runs at startup, before any command.
+async def finish_hires(guild_id=None):
+    applications = await get_store(APPLICATIONS_FILE, guild_id)
+    hiring = await applications.find('status', 'hiring')
+    if not hiring:
+        return 0
+    businesses = await get_store(BUSINESS_FILE, guild_id)
+    resolved = []
+    for app in hiring:
+        app = dict(app)
+        business = await businesses.get(app['business_id'])
+        if business is None:
+            resolved.append(_resolve(app, 'denied', 'business closed'))
+            continue
+        applicant_id = str(app['applicant_id'])
+        user_data = await get_user_data(applicant_id, guild_id)
+        _hire(business, user_data, app)
+        await businesses.put(app['business_id'], business)
+        await update_users([(applicant_id, user_data)], guild_id)
+        resolved.append(_resolve(app, 'approved'))
+    await businesses.flush()
+    await (await get_store(ECONOMY_FILE, guild_id)).flush()
+    await archive(APPLICATION_ARCHIVE_FILE, resolved, guild_id)
+    for app in resolved:
+        await applications.delete(app['id'])
+    await applications.flush()
+    return len(resolved)
+
+async def finish_all_hires():
+    finished = 0
+    for part in await known_partitions():
+        async with borrow(part):
+            finished += await finish_hires(part)
+    if finished:
+        print(f'Finished {finished:,} interrupted hire(s).')
+
+async def expire_applications(guild_id=None):
+    cutoff = (datetime.now() - timedelta(days=APPLICATION_EXPIRY_DAYS)).isoformat()
+    applications = await get_store(APPLICATIONS_FILE, guild_id)
+    stale = [app for app in await applications.values() if app['applied_at'] < cutoff and app['status'] == 'pending']
+    expired = []
+    for app in stale:
+        expired.append(_resolve(dict(app), 'expired'))
+        await applications.delete(app['id'])
+    await archive(APPLICATION_ARCHIVE_FILE, expired, guild_id)
+    return len(expired)
+
+async def expire_loop(interval=3600):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            for part in await known_partitions():
+                async with borrow(part):
+                    await expire_applications(part)
+        except Exception as e:
+            print(f'Failed to expire applications: {e}')
@@ -0,0 +1,128 @@
+# bank.py
+#
+# Balance changes that read and write records across an await. Every user and
+# business has its own asyncio.Lock; operations that touch several records take
+# their locks in sorted order, so two commands can never deadlock and
+# unrelated users never wait on each other. In a sharded deployment the locks
+# are held by the storage daemon instead, on behalf of every worker process.
+# Locks are per user, not per user and server: taking one for a user's record
+# in one server's economy also holds off changes to it in the others, which
+# costs nothing unless they play in several at once.
+# The helpers here log what they change to the ledger.
+
+import asyncio
+import weakref
+import ledger
+from contextlib import asynccontextmanager
+from storage import get_user_data, update_user_data, update_users, remote_client
+
+class InsufficientFunds(Exception):
+    pass
+
+_locks = weakref.WeakValueDictionary()
+
+def _get_lock(key):
+    lock = _locks.get(key)
+    if lock is None:
+        lock = _locks[key] = asyncio.Lock()
+    return lock
+
+def lock_keys(users=(), businesses=()):
+    return sorted({f'user:{user_id}' for user_id in users} | {f'business:{business_id}' for business_id in businesses})
+
+# Takes the locks for `keys` (already sorted) and returns them for release().
+# The storage daemon uses these directly to hold locks for worker processes.
+async def acquire(keys):
+    acquired = []
+    try:
+        for key in keys:
+            lock = _get_lock(key)
+            await lock.acquire()
+            acquired.append(lock)
+    except BaseException:
+        release(acquired)
+        raise
+    return acquired
+
+def release(locks):
+    for lock in reversed(locks):
+        lock.release()
+
+# Ids of the users (businesses) whose lock someone holds right now, in this
+# process (in the storage daemon, that covers every worker's locks). A write
+# made without awaiting since this was called can't land between anyone
+# else's read and write of a record not in it.
+def held_users():
+    return _held('user:')
+
+def held_businesses():
+    return _held('business:')
+
+def _held(prefix):
+    return {key[len(prefix):] for key, lock in list(_locks.items()) if key.startswith(prefix) and lock.locked()}
+
+@asynccontextmanager
+async def locked(users=(), businesses=()):
+    keys = lock_keys(users, businesses)
+    client = remote_client()
+    if client is not None:
+        # Sharded workers lock through the storage daemon, so the lock holds
+        # across every process.
+        async with client.locked(keys):
+            yield
+        return
+    locks = await acquire(keys)
+    try:
+        yield
+    finally:
+        release(locks)
+
+# Takes `cost` out of the bank first and the wallet for the rest, the way
+# business fees have always been charged. Only for use while holding the
+# user's lock. Returns the (wallet, bank) amounts taken, or None (changing
+# nothing) if net worth is too low.
+def charge(user_data, cost):
+    if user_data['balance'] + user_data['bank'] < cost:
+        return None
+    from_bank = min(cost, user_data['bank'])
+    user_data['bank'] -= from_bank
+    user_data['balance'] -= cost - from_bank
+    return cost - from_bank, from_bank
+
+# Adds `delta` to the wallet. A negative delta larger than the wallet raises
+# InsufficientFunds instead of going below zero.
+async def adjust_balance(user_id, delta, reason, ref=None, guild_id=None):
+    async with locked(users=[user_id]):
+        user_data = await get_user_data(user_id, guild_id)
+        if user_data['balance'] + delta < 0:
+            raise InsufficientFunds(user_data['balance'])
+        user_data['balance'] += delta
+        await update_user_data(user_id, user_data, guild_id)
+        await ledger.record(user_id, user_data, reason, balance=delta, ref=ref, guild_id=guild_id)
+        return user_data
+
+# Moves `amount` from one user's wallet to another's. Both records are saved
+# with one update_users(), so they land in the same write-back (and, sharded,
+# in one request to the storage daemon), then the move is logged. Takes both
+# users' locks, unless the caller already holds them and passes the (sender,
+# receiver) records it read under them as `records`: /rob checks its cooldown
+# and both wallets first. Returns the (sender, receiver) records.
+async def transfer(from_id, to_id, amount, reason, guild_id=None, records=None):
+    if str(from_id) == str(to_id):
+        raise ValueError("can't transfer to the same user")
+    if records is not None:
+        return await _transfer(from_id, to_id, amount, reason, guild_id, *records)
+    async with locked(users=[from_id, to_id]):
+        sender = await get_user_data(from_id, guild_id)
+        receiver = await get_user_data(to_id, guild_id)
+        return await _transfer(from_id, to_id, amount, reason, guild_id, sender, receiver)
+
+async def _transfer(from_id, to_id, amount, reason, guild_id, sender, receiver):
+    if sender['balance'] < amount:
+        raise InsufficientFunds(sender['balance'])
+    sender['balance'] -= amount
+    receiver['balance'] += amount
+    await update_users([(from_id, sender), (to_id, receiver)], guild_id)
+    await ledger.record_many([(from_id, sender, -amount, 0), (to_id, receiver, amount, 0)], reason,
+                             guild_id=guild_id)
+    return sender, receiver
@@ -0,0 +1,313 @@
+# bench.py
+#
+# Offline load test. Builds the Economy and Business cogs against fake
+# Interaction / Context / Bot objects (no Discord connection), generates a
+# dataset in a scratch directory and replays a random mix of commands at the
+# given concurrency. Reports throughput, latency percentiles per command and
+# storage bytes written per command.
+#
+#     python bench.py --users 100000 --ops 20000 --concurrency 100
+#     python bench.py --suite            # 1k, 100k and 1M users, one process each
+#     python bench.py --backend sqlite   # same, against the SQLite backend
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SUITE_SIZES = (1_000, 100_000, 1_000_000)
+BASE_ID = 100_000_000_000_000_000
+GUILD_ID = 1  # every command runs in this server, whose economy holds the dataset
+
+WORKLOAD = {
+    'bal': 30,
+    'work': 20,
+    'top': 10,
+    'rob': 15,
+    'roulette': 10,
+    'business_apply': 5,
+    'business_list': 10,
+}
+
+# ======= FAKE DISCORD OBJECTS =======
+class FakeUser:
+    def __init__(self, id):
+        self.id = id
+        self.name = f"user{id % 1_000_000}"
+        self.display_name = self.name
+        self.mention = f"<@{id}>"
+        self.roles = []
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    async def send(self, *args, **kwargs):
+        pass
+
+class FakeGuild:
+    def __init__(self, id):
+        self.id = id
+
+    def get_member(self, user_id):
+        return FakeUser(user_id)
+
+class FakeChannel:
+    def __init__(self, id):
+        self.id = id
+
+    async def send(self, *args, **kwargs):
+        pass
+
+class FakeResponse:
+    def __init__(self):
+        self.done = False
+        self.modal = None
+
+    def is_done(self):
+        return self.done
+
+    async def send_message(self, *args, **kwargs):
+        self.done = True
+
+    async def edit_message(self, *args, **kwargs):
+        self.done = True
+
+    async def send_modal(self, modal):
+        self.modal = modal
+        self.done = True
+
+    async def defer(self, *args, **kwargs):
+        self.done = True
+
+class FakeFollowup:
+    async def send(self, *args, **kwargs):
+        pass
+
+class FakeInteraction:
+    def __init__(self, user, guild, channel):
+        self.user = user
+        self.guild = guild
+        self.guild_id = guild.id
+        self.channel = channel
+        self.channel_id = channel.id
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+        self.extras = {}
+
+class FakeContext:
+    def __init__(self, user, guild, channel):
+        self.author = user
+        self.guild = guild
+        self.channel = channel
+        self.interaction = FakeInteraction(user, guild, channel)
+
+    async def send(self, *args, **kwargs):
+        pass
+
+class FakeBot:
+    def __init__(self):
+        self.channel = FakeChannel(1)
+
+    def get_user(self, user_id):
+        return None
+
+    def get_channel(self, channel_id):
+        return self.channel
+
+    async def fetch_user(self, user_id):
+        await asyncio.sleep(0)
+        return FakeUser(user_id)
+
+    def add_dynamic_items(self, *items):
+        pass
+
+    def remove_dynamic_items(self, *items):
+        pass
+
+# ======= DATASET =======
+def generate_dataset(users, seed):
+    from config import ECONOMY_FILE, BUSINESS_FILE
+    from guilds import partition, partition_path
+    rng = random.Random(seed)
+    economy = {}
+    for i in range(users):
+        economy[str(BASE_ID + i)] = {
+            'balance': rng.randint(0, 5000),
+            'bank': rng.randint(0, 20000),
+        }
+    businesses = {}
+    for i in range(max(1, users // 100)):
+        owner_id = BASE_ID + i
+        business_id = f"biz_{owner_id}_0"
+        businesses[business_id] = {
+            'id': business_id,
+            'name': f"Business {i}",
+            'description': "Generated for benchmarking.",
+            'owner_id': owner_id,
+            'owner_name': f"user{owner_id % 1_000_000}",
+            'level': rng.randint(1, 5),
+            'employees': {},
+            'max_employees': 3,
+            'work_bonus': 1.5,
+            'created_at': "2024-01-01T00:00:00",
+            'upgrades': {
+                'premium_office': False,
+                'employee_benefits': False,
+                'marketing_boost': False,
+                'security_system': False
+            },
+            'revenue': 0,
+            'total_employees_hired': 0
+        }
+    part = partition(GUILD_ID)
+    for filename, data in ((ECONOMY_FILE, economy), (BUSINESS_FILE, businesses)):
+        path = partition_path(filename, part)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(data, f)
+    return len(businesses)
+
+# ======= RUNNER =======
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+async def run(args):
+    import stats
+    stats.STATS_ENABLED = True
+    import storage
+    import roulette
+    storage.STORAGE_BACKEND = args.backend
+    storage.FLUSH_INTERVAL = args.flush_interval
+    roulette.ROULETTE_ROUND_SECONDS = 1
+    from economy import Economy
+    from business import Business
+
+    if args.backend == 'sqlite':
+        import migrate
+        await migrate.migrate()
+
+    bot = FakeBot()
+    economy = Economy(bot)
+    business = Business(bot)
+    load_start = time.perf_counter()
+    await economy.cog_load()
+    await business.cog_load()
+    print(f"cog load: {time.perf_counter() - load_start:.2f}s")
+
+    rng = random.Random(args.seed)
+    guild = FakeGuild(GUILD_ID)
+    businesses = max(1, args.users // 100)
+
+    def random_user():
+        return FakeUser(BASE_ID + rng.randrange(args.users))
+
+    def interaction(user):
+        return FakeInteraction(user, guild, bot.channel)
+
+    def context(user):
+        return FakeContext(user, guild, bot.channel)
+
+    # Opens the application form, then submits it the way the modal would.
+    async def apply():
+        ctx = context(random_user())
+        await business.business.callback(business, ctx, "apply", business_name=f"Business {rng.randrange(businesses)}")
+        modal = ctx.interaction.response.modal
+        if modal is not None:
+            await business.submit_application(FakeInteraction(ctx.author, guild, bot.channel), modal.business_id, {
+                'reason': "Benchmark answer",
+                'experience': "None",
+                'availability': "Weekends",
+            })
+
+    commands = {
+        'bal': lambda: economy.bal.callback(economy, interaction(random_user()), None),
+        'top': lambda: economy.top.callback(economy, interaction(random_user()), rng.randint(1, 3)),
+        'rob': lambda: economy.rob.callback(economy, interaction(random_user()), random_user()),
+        'roulette': lambda: economy.roulette.callback(economy, interaction(random_user()), rng.choice(["red", "black"]), 100),
+        'work': lambda: business.work.callback(business, context(random_user())),
+        'business_list': lambda: business.business.callback(business, context(random_user()), "list"),
+        'business_apply': apply,
+    }
+    names = list(WORKLOAD)
+    weights = [WORKLOAD[name] for name in names]
+    plan = rng.choices(names, weights, k=args.ops)
+
+    latencies = {name: [] for name in names}
+    bytes_by_command = dict.fromkeys(names, 0)
+    errors = {}
+    queue = iter(plan)
+
+    async def worker():
+        for name in queue:
+            bytes_before = stats.counters['storage.bytes_written']
+            start = time.perf_counter()
+            try:
+                await commands[name]()
+            except Exception as e:
+                errors[name] = errors.get(name, 0) + 1
+                if errors[name] == 1:
+                    print(f"{name} failed: {e!r}")
+            latencies[name].append(time.perf_counter() - start)
+            # Flushes run in the background, so this only catches writes the
+            # command itself caused (threshold flushes, roulette bets).
+            bytes_by_command[name] += stats.counters['storage.bytes_written'] - bytes_before
+
+    flusher = asyncio.create_task(storage.flush_loop())
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    # Let the last roulette rounds settle and write everything out.
+    await asyncio.sleep(1.5)
+    flusher.cancel()
+    await storage.flush_all()
+
+    total_bytes = stats.counters['storage.bytes_written']
+    print(f"\n{args.ops:,} ops over {args.users:,} users ({args.backend}, concurrency {args.concurrency})")
+    print(f"elapsed {elapsed:.2f}s, throughput {args.ops / elapsed:,.0f} ops/s")
+    print(f"storage bytes written {total_bytes:,} ({total_bytes / args.ops:,.0f} per op, including background flushes)\n")
+    print(f"{'command':<16}{'ops':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'bytes/op':>12}{'errors':>8}")
+    for name in names:
+        samples = sorted(latencies[name])
+        if not samples:
+            continue
+        print(f"{name:<16}{len(samples):>8,}"
+              + "".join(f"{percentile(samples, p) * 1000:>8.2f}ms" for p in (0.50, 0.95, 0.99))
+              + f"{bytes_by_command[name] / len(samples):>12,.0f}{errors.get(name, 0):>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the economy bot.")
+    parser.add_argument('--users', type=int, default=1_000)
+    parser.add_argument('--ops', type=int, default=5_000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--backend', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--flush-interval', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--suite', action='store_true', help="run 1k, 100k and 1M users in separate processes")
+    args = parser.parse_args()
+
+    if args.suite:
+        for users in SUITE_SIZES:
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--users', str(users), '--ops', str(args.ops),
+                            '--concurrency', str(args.concurrency), '--backend', args.backend,
+                            '--flush-interval', str(args.flush_interval), '--seed', str(args.seed)], check=True)
+        return
+
+    sys.path.insert(0, ROOT)
+    with tempfile.TemporaryDirectory(prefix='economy_bench_') as scratch:
+        os.chdir(scratch)
+        generate_start = time.perf_counter()
+        businesses = generate_dataset(args.users, args.seed)
+        print(f"generated {args.users:,} users and {businesses:,} businesses in {time.perf_counter() - generate_start:.2f}s")
+        asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,379 @@
+import asyncio
 import discord
+from discord import app_commands
 from discord.ext import commands
-from storage import get_user_data, update_user_data, load_data, save_data
-from config import BUSINESS_FILE, APPLICATIONS_FILE
+from storage import get_user_data, update_user_data, get_store, name_key, subscribe_evictions, unsubscribe_evictions
+from guilds import partition, setting
+from config import BUSINESS_FILE, APPLICATIONS_FILE, ECONOMY_SCOPE
 from datetime import datetime
 from math import floor
-import asyncio
 import random
+import bank
+import difflib
+import ledger
+from cooldowns import get_cooldowns
+from names import get_names, owner_name
+from applications import pending_applications, review_applications, ReviewError
+from stats import timed
+
+LIST_PAGE_SIZE = 10
+REVIEW_PAGE_SIZE = 5
+
+# The server a prefix or slash invocation came from, None in DMs.
+def guild_of(ctx):
+    return ctx.guild.id if ctx.guild else None
+
+# What /business list shows for one business. Changes that don't touch these
+# fields (like a work session being counted) leave the cached pages alone.
+def listing_summary(business):
+    description = business['description']
+    return (
+        business['name'],
+        business['level'],
+        business['owner_name'],
+        f"{description[:100]}{'...' if len(description) > 100 else ''}",
+        len(business['employees']),
+        business['max_employees'],
+        business['work_bonus'],
+    )
+
+# /business list for one economy's businesses. The hiring-first ordering and
+# the rendered pages are cached per filter until a listed field changes.
+class BusinessListing:
+    def __init__(self, businesses):
+        self.summaries = {business_id: listing_summary(business) for business_id, business in businesses}
+        self.orders = {}
+        self.pages = {}
+
+    def update(self, business_id, business):
+        summary = listing_summary(business) if business else None
+        if self.summaries.get(business_id) == summary:
+            return
+        if summary is None:
+            self.summaries.pop(business_id, None)
+        else:
+            self.summaries[business_id] = summary
+        self.orders.clear()
+        self.pages.clear()
+
+    def order(self, hiring_only):
+        order = self.orders.get(hiring_only)
+        if order is None:
+            summaries = self.summaries.values()
+            if hiring_only:
+                summaries = [summary for summary in summaries if summary[4] < summary[5]]
+            # Hiring first, then highest level, then by name.
+            order = self.orders[hiring_only] = sorted(
+                summaries, key=lambda summary: (summary[4] >= summary[5], -summary[1], summary[0].casefold()))
+        return order
+
+    def page_count(self, hiring_only):
+        return max(1, (len(self.order(hiring_only)) + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE)
+
+    def page(self, hiring_only, page):
+        embed = self.pages.get((hiring_only, page))
+        if embed is not None:
+            return embed
+        order = self.order(hiring_only)
+        title = "🏢 Businesses Hiring Now" if hiring_only else "🏢 Available Businesses"
+        embed = discord.Embed(title=title, color=0x0099ff)
+        for name, level, owner_name, description, employee_count, max_employees, work_bonus in \
+                order[page * LIST_PAGE_SIZE:(page + 1) * LIST_PAGE_SIZE]:
+            hiring_status = "🟢 Hiring" if employee_count < max_employees else "🔴 Full"
+            embed.add_field(
+                name=f"{name} (Level {level})",
+                value=f"👤 Owner: {owner_name}\n"
+                      f"📝 {description}\n"
+                      f"👥 Employees: {employee_count}/{max_employees} {hiring_status}\n"
+                      f"💰 Work Bonus: {work_bonus}x",
+                inline=False
+            )
+        if not order:
+            embed.description = "No businesses are hiring right now."
+        embed.set_footer(text=f"Page {page + 1}/{self.page_count(hiring_only)} • "
+                              "Use `/business apply <business_name>` to apply for a job!")
+        self.pages[(hiring_only, page)] = embed
+        return embed
+
+class BusinessListView(discord.ui.View):
+    def __init__(self, listing, author_id):
+        super().__init__(timeout=180)
+        self.listing = listing
+        self.author_id = author_id
+        self.hiring_only = False
+        self.page = 0
+
+    async def interaction_check(self, interaction):
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("Use `/business list` to browse businesses yourself.", ephemeral=True)
+            return False
+        return True
+
+    def render(self):
+        pages = self.listing.page_count(self.hiring_only)
+        self.page = min(self.page, pages - 1)
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= pages - 1
+        self.toggle_hiring.label = "Show all" if self.hiring_only else "Hiring only"
+        return self.listing.page(self.hiring_only, self.page)
+
+    @discord.ui.button(label="◀ Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        self.page -= 1
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction, button):
+        self.page += 1
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(label="Hiring only", style=discord.ButtonStyle.primary)
+    async def toggle_hiring(self, interaction, button):
+        self.hiring_only = not self.hiring_only
+        self.page = 0
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+UPGRADES = {
+    'premium_office': {'name': 'Premium Office', 'cost': 10000, 'desc': 'Double employee capacity (3→6)'},
+    'employee_benefits': {'name': 'Employee Benefits', 'cost': 7500, 'desc': 'Increase work bonus by 0.5x'},
+    'marketing_boost': {'name': 'Marketing Boost', 'cost': 5000, 'desc': 'Attract more job applicants'},
+    'security_system': {'name': 'Security System', 'cost': 8000, 'desc': 'Protect from theft events'}
+}
+
+# The whole questionnaire in one form. Nothing waits on the bot's side while
+# the applicant types, and the application is only written on submit.
+class ApplicationModal(discord.ui.Modal):
+    reason = discord.ui.TextInput(label="Why do you want to work here?", style=discord.TextStyle.paragraph,
+                                  max_length=500)
+    experience = discord.ui.TextInput(label="Previous experience", style=discord.TextStyle.paragraph,
+                                      max_length=300, required=False, placeholder="None")
+    availability = discord.ui.TextInput(label="Availability", max_length=100,
+                                        placeholder="e.g. evenings, weekends")
+
+    def __init__(self, cog, business):
+        super().__init__(title=f"Apply to {business['name']}"[:45])
+        self.cog = cog
+        self.business_id = business['id']
+
+    async def on_submit(self, interaction):
+        await self.cog.submit_application(interaction, self.business_id, {
+            'reason': self.reason.value,
+            'experience': self.experience.value or "None",
+            'availability': self.availability.value,
+        })
+
+# Buy buttons under /upgrade_business. Everything the click needs is in the
+# custom id, so the buttons keep working after a restart.
+class UpgradeButton(discord.ui.DynamicItem[discord.ui.Button], template=r'upgrade:(?P<business_id>[^:]+):(?P<upgrade>\w+)'):
+    def __init__(self, business_id, upgrade):
+        super().__init__(discord.ui.Button(
+            label=f"Buy {UPGRADES[upgrade]['name']}" if upgrade in UPGRADES else "Buy",
+            style=discord.ButtonStyle.success,
+            custom_id=f"upgrade:{business_id}:{upgrade}"
+        ))
+        self.business_id = business_id
+        self.upgrade = upgrade
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(match['business_id'], match['upgrade'])
+
+    async def callback(self, interaction):
+        await interaction.client.get_cog('Business').purchase_upgrade(interaction, self.business_id, self.upgrade)
+
+# Pending applications to one business, a page at a time. Applications picked
+# in the menu are approved or denied together.
+class ApplicationReviewView(discord.ui.View):
+    def __init__(self, business, author_id, guild_id):
+        super().__init__(timeout=300)
+        self.business = business
+        self.author_id = author_id
+        self.guild_id = guild_id
+        self.pending = []
+        self.selected = []
+        self.page = 0
+
+    async def interaction_check(self, interaction):
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("Only the owner can review these applications.", ephemeral=True)
+            return False
+        return True
+
+    async def refresh(self):
+        self.pending = await pending_applications(self.business['id'], self.guild_id)
+        self.selected = []
+
+    def render(self):
+        pages = max(1, (len(self.pending) + REVIEW_PAGE_SIZE - 1) // REVIEW_PAGE_SIZE)
+        self.page = min(self.page, pages - 1)
+        shown = self.pending[self.page * REVIEW_PAGE_SIZE:(self.page + 1) * REVIEW_PAGE_SIZE]
+        embed = discord.Embed(
+            title=f"📋 Applications to {self.business['name']}",
+            description=f"{len(self.pending):,} pending" if self.pending else "No pending applications.",
+            color=0x0099ff
+        )
+        for app in shown:
+            embed.add_field(
+                name=f"{app['applicant_name']} • applied {app['applied_at'][:10]}",
+                value=f"**Why:** {app['reason'][:300]}\n**Experience:** {app['experience'][:200]}\n"
+                      f"**Availability:** {app['availability']}",
+                inline=False
+            )
+        embed.set_footer(text=f"Page {self.page + 1}/{pages}")
+        if shown:
+            self.choose.options = [discord.SelectOption(label=app['applicant_name'][:100], value=app['id'],
+                                                        description=app['availability'][:100] or None)
+                                   for app in shown]
+        else:
+            self.choose.options = [discord.SelectOption(label="Nothing to review", value="none")]
+        self.choose.max_values = len(self.choose.options)
+        self.choose.disabled = not shown
+        self.approve.disabled = self.deny.disabled = not self.selected
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= pages - 1
+        return embed
+
+    @discord.ui.select(placeholder="Choose applications to review", min_values=1)
+    async def choose(self, interaction, select):
+        self.selected = list(select.values)
+        self.approve.disabled = self.deny.disabled = False
+        await interaction.response.edit_message(view=self)
+
+    @discord.ui.button(label="Approve selected", style=discord.ButtonStyle.success, row=1)
+    async def approve(self, interaction, button):
+        await self.resolve(interaction, approve=True)
+
+    @discord.ui.button(label="Deny selected", style=discord.ButtonStyle.danger, row=1)
+    async def deny(self, interaction, button):
+        await self.resolve(interaction, approve=False)
+
+    @discord.ui.button(label="◀ Previous", style=discord.ButtonStyle.secondary, row=2)
+    async def previous_page(self, interaction, button):
+        self.page -= 1
+        self.selected = []
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.secondary, row=2)
+    async def next_page(self, interaction, button):
+        self.page += 1
+        self.selected = []
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    async def resolve(self, interaction, approve):
+        try:
+            approved, denied, left = await review_applications(
+                interaction.user.id, self.business['id'], self.selected, approve, self.guild_id)
+        except ReviewError as e:
+            await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+            return
+        summary = []
+        if approved:
+            summary.append(f"✅ Hired {', '.join(app['applicant_name'] for app in approved)}.")
+        if denied:
+            summary.append(f"❌ Denied {len(denied):,} application(s).")
+        if left:
+            summary.append(f"⏸ {len(left):,} left pending: the business is full.")
+        await self.refresh()
+        await interaction.response.edit_message(content="\n".join(summary) or None, embed=self.render(), view=self)
 
 class Business(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.listings = {}  # partition -> future of its BusinessListing
+        self.names = get_names(bot)
+
+    # A server's listing is built the first time /business list is used
+    # there, and dropped when its economy is closed for being idle. With one
+    # economy for every server it is built in the background straight away
+    # instead, so it doesn't hold up startup.
+    async def cog_load(self):
+        if ECONOMY_SCOPE == 'global':
+            self.listing_loader(None)
+        subscribe_evictions(self.drop_listing)
+        self.bot.add_dynamic_items(UpgradeButton)
+        self.names.start()
+
+    async def cog_unload(self):
+        for loading in self.listings.values():
+            loading.cancel()
+        unsubscribe_evictions(self.drop_listing)
+        self.bot.remove_dynamic_items(UpgradeButton)
+        self.names.stop()
+
+    def listing_loader(self, guild_id):
+        part = partition(guild_id)
+        loading = self.listings.get(part)
+        if loading is None:
+            loading = self.listings[part] = asyncio.ensure_future(self.load_listing(part))
+        return loading
+
+    async def listing(self, guild_id):
+        await get_store(BUSINESS_FILE, guild_id)  # a use of the server (see storage.py)
+        return await asyncio.shield(self.listing_loader(guild_id))
+
+    def drop_listing(self, part):
+        self.listings.pop(part, None)
+
+    async def load_listing(self, part):
+        businesses = await get_store(BUSINESS_FILE, part)
+        listing = BusinessListing(await businesses.items())
+        businesses.subscribe(listing.update)
+        return listing
+
+    # Renamed owners get their businesses' owner_name updated by names.py.
+    @commands.Cog.listener()
+    async def on_user_update(self, before, after):
+        if before.display_name != after.display_name:
+            self.names.user_renamed(after.id)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        if before.display_name != after.display_name:
+            self.names.user_renamed(after.id)
 
     @commands.hybrid_command(name='create_business', description='Create your own business')
+    @timed('create_business')
     async def create_business(self, ctx, name: str, *, description: str):
-        user_data = get_user_data(ctx.author.id)
-        businesses = load_data(BUSINESS_FILE)
-        for business in businesses.values():
-            if business['owner_id'] == ctx.author.id:
+        guild_id = guild_of(ctx)
+        # The name is locked too, so two owners can't claim it at once.
+        async with bank.locked(users=[ctx.author.id], businesses=[f'name:{name_key(name)}']):
+            user_data = await get_user_data(ctx.author.id, guild_id)
+            businesses = await get_store(BUSINESS_FILE, guild_id)
+            if await businesses.find('owner_id', ctx.author.id):
                 await ctx.send("❌ You already own a business!", ephemeral=True)
                 return
-        creation_fee = 5000
-        if user_data['balance'] + user_data['bank'] < creation_fee:
-            await ctx.send(f"❌ You need ${creation_fee:,} to create a business!\nYour net worth: ${user_data['balance'] + user_data['bank']:,}", ephemeral=True)
-            return
-        if user_data['bank'] >= creation_fee:
-            user_data['bank'] -= creation_fee
-        else:
-            remaining = creation_fee - user_data['bank']
-            user_data['bank'] = 0
-            user_data['balance'] -= remaining
-        business_id = f"biz_{ctx.author.id}_{int(datetime.now().timestamp())}"
-        businesses[business_id] = {
-            'id': business_id,
-            'name': name,
-            'description': description,
-            'owner_id': ctx.author.id,
-            'owner_name': ctx.author.display_name,
-            'level': 1,
-            'employees': {},
-            'max_employees': 3,
-            'work_bonus': 1.5,
-            'created_at': datetime.now().isoformat(),
-            'upgrades': {
-                'premium_office': False,
-                'employee_benefits': False,
-                'marketing_boost': False,
-                'security_system': False
-            },
-            'revenue': 0,
-            'total_employees_hired': 0
-        }
-        update_user_data(ctx.author.id, user_data)
-        save_data(BUSINESS_FILE, businesses)
+            if await businesses.find('name_key', name_key(name)):
+                await ctx.send(f"❌ A business named '{name}' already exists!", ephemeral=True)
+                return
+            creation_fee = setting(guild_id, 'BUSINESS_CREATION_FEE')
+            paid = bank.charge(user_data, creation_fee)
+            if paid is None:
+                await ctx.send(f"❌ You need ${creation_fee:,} to create a business!\nYour net worth: ${user_data['balance'] + user_data['bank']:,}", ephemeral=True)
+                return
+            business_id = f"biz_{ctx.author.id}_{int(datetime.now().timestamp())}"
+            await businesses.put(business_id, {
+                'id': business_id,
+                'name': name,
+                'description': description,
+                'owner_id': ctx.author.id,
+                'owner_name': owner_name(ctx.author, partition(guild_id)),
+                'level': 1,
+                'employees': {},
+                'max_employees': 3,
+                'work_bonus': 1.5,
+                'created_at': datetime.now().isoformat(),
+                'upgrades': {
+                    'premium_office': False,
+                    'employee_benefits': False,
+                    'marketing_boost': False,
+                    'security_system': False
+                },
+                'revenue': 0,
+                'total_employees_hired': 0
+            })
+            await update_user_data(ctx.author.id, user_data, guild_id)
+            await ledger.record(ctx.author.id, user_data, 'business_creation',
+                                balance=-paid[0], bank=-paid[1], ref=business_id, guild_id=guild_id)
         embed = discord.Embed(
             title="🏢 Business Created!",
             description=f"**{name}** has been established!\n\n📝 {description}",
@@ -63,36 +385,22 @@ class Business(commands.Cog):
         await ctx.send(embed=embed)
 
     @commands.hybrid_command(name='business', description='View business information or apply to work')
+    @timed('business')
     async def business(self, ctx, action: str = "list", *, business_name: str = None):
-        businesses = load_data(BUSINESS_FILE)
+        businesses = await get_store(BUSINESS_FILE, guild_of(ctx))
         if action.lower() == "list":
-            if not businesses:
+            listing = await self.listing(guild_of(ctx))
+            if not listing.summaries:
                 await ctx.send("🏢 No businesses found. Use `/create_business` to start one.", ephemeral=True)
                 return
-            embed = discord.Embed(title="🏢 Available Businesses", color=0x0099ff)
-            for business in businesses.values():
-                employee_count = len(business['employees'])
-                max_employees = business['max_employees']
-                hiring_status = "🟢 Hiring" if employee_count < max_employees else "🔴 Full"
-                embed.add_field(
-                    name=f"{business['name']} (Level {business['level']})",
-                    value=f"👤 Owner: {business['owner_name']}\n"
-                          f"📝 {business['description'][:100]}{'...' if len(business['description']) > 100 else ''}\n"
-                          f"👥 Employees: {employee_count}/{max_employees} {hiring_status}\n"
-                          f"💰 Work Bonus: {business['work_bonus']}x",
-                    inline=False
-                )
-            embed.set_footer(text="Use `/business apply <business_name>` to apply for a job!")
-            await ctx.send(embed=embed)
+            view = BusinessListView(listing, ctx.author.id)
+            await ctx.send(embed=view.render(), view=view)
         elif action.lower() == "apply":
             if not business_name:
                 await ctx.send("❌ Please specify which business you want to apply to!", ephemeral=True)
                 return
-            target_business = None
-            for business in businesses.values():
-                if business['name'].lower() == business_name.lower():
-                    target_business = business
-                    break
+            matches = await businesses.find('name_key', name_key(business_name))
+            target_business = matches[0] if matches else None
             if not target_business:
                 await ctx.send(f"❌ No business named '{business_name}' was found.", ephemeral=True)
                 return
@@ -102,66 +410,70 @@ class Business(commands.Cog):
             if str(ctx.author.id) in target_business['employees']:
                 await ctx.send(f"❌ You already work at **{target_business['name']}**!", ephemeral=True)
                 return
-            await ctx.send("Why do you want to work here? (Type your answer below, 500 chars max)")
-            def check(m):
-                return m.author == ctx.author and m.channel == ctx.channel
-            try:
-                reason_msg = await self.bot.wait_for('message', timeout=60, check=check)
-            except asyncio.TimeoutError:
-                await ctx.send("Timed out! Please try again.")
+            if ctx.interaction is None:
+                await ctx.send("Use the `/business apply` slash command to fill in the application form.")
                 return
-            await ctx.send("Describe your previous experience (or type 'none'):")
-            try:
-                experience_msg = await self.bot.wait_for('message', timeout=60, check=check)
-            except asyncio.TimeoutError:
-                await ctx.send("Timed out! Please try again.")
-                return
-            await ctx.send("What is your availability? (e.g. evenings, weekends, etc.)")
-            try:
-                avail_msg = await self.bot.wait_for('message', timeout=60, check=check)
-            except asyncio.TimeoutError:
-                await ctx.send("Timed out! Please try again.")
-                return
-            applications = load_data(APPLICATIONS_FILE)
-            app_id = f"app_{ctx.author.id}_{target_business['id']}_{int(datetime.now().timestamp())}"
-            applications[app_id] = {
-                'id': app_id,
-                'business_id': target_business['id'],
-                'business_name': target_business['name'],
-                'applicant_id': ctx.author.id,
-                'applicant_name': ctx.author.display_name,
-                'reason': reason_msg.content[:500],
-                'experience': experience_msg.content[:300],
-                'availability': avail_msg.content[:100],
-                'status': 'pending',
-                'applied_at': datetime.now().isoformat()
-            }
-            save_data(APPLICATIONS_FILE, applications)
-            try:
-                owner = await self.bot.fetch_user(target_business['owner_id'])
-                if owner:
-                    embed = discord.Embed(
-                        title="📋 New Job Application!",
-                        description=f"**{ctx.author.display_name}** applied to work at **{target_business['name']}**",
-                        color=0x0099ff
-                    )
-                    embed.add_field(name="Why they want to work here:", value=reason_msg.content, inline=False)
-                    embed.add_field(name="Experience:", value=experience_msg.content, inline=True)
-                    embed.add_field(name="Availability:", value=avail_msg.content, inline=True)
-                    embed.set_footer(text="Use /manage_business to approve or deny applications")
-                    await owner.send(embed=embed)
-            except Exception:
-                pass
-            await ctx.send(f"✅ Your application to **{target_business['name']}** has been sent!", ephemeral=True)
+            await ctx.interaction.response.send_modal(ApplicationModal(self, target_business))
+
+    # The business is looked up again: it may have filled up or gone while
+    # the form was open.
+    @timed('submit_application')
+    async def submit_application(self, interaction, business_id, answers):
+        businesses = await get_store(BUSINESS_FILE, interaction.guild_id)
+        target_business = await businesses.get(business_id)
+        if not target_business:
+            await interaction.response.send_message("❌ That business no longer exists.", ephemeral=True)
+            return
+        if len(target_business['employees']) >= target_business['max_employees']:
+            await interaction.response.send_message(f"❌ **{target_business['name']}** is no longer hiring.", ephemeral=True)
+            return
+        applications = await get_store(APPLICATIONS_FILE, interaction.guild_id)
+        app_id = f"app_{interaction.user.id}_{target_business['id']}_{int(datetime.now().timestamp())}"
+        await applications.put(app_id, {
+            'id': app_id,
+            'business_id': target_business['id'],
+            'business_name': target_business['name'],
+            'applicant_id': interaction.user.id,
+            'applicant_name': interaction.user.display_name,
+            'reason': answers['reason'][:500],
+            'experience': answers['experience'][:300],
+            'availability': answers['availability'][:100],
+            'status': 'pending',
+            'applied_at': datetime.now().isoformat()
+        })
+        await interaction.response.send_message(f"✅ Your application to **{target_business['name']}** has been sent!", ephemeral=True)
+        try:
+            owner = await self.names.user(target_business['owner_id'])
+            if owner:
+                embed = discord.Embed(
+                    title="📋 New Job Application!",
+                    description=f"**{interaction.user.display_name}** applied to work at **{target_business['name']}**",
+                    color=0x0099ff
+                )
+                embed.add_field(name="Why they want to work here:", value=answers['reason'], inline=False)
+                embed.add_field(name="Experience:", value=answers['experience'], inline=True)
+                embed.add_field(name="Availability:", value=answers['availability'], inline=True)
+                embed.set_footer(text="Use /applications to approve or deny applications")
+                await owner.send(embed=embed)
+        except Exception:
+            pass
+
+    @business.autocomplete('business_name')
+    async def business_name_autocomplete(self, interaction: discord.Interaction, current: str):
+        businesses = await get_store(BUSINESS_FILE, interaction.guild_id)
+        key = name_key(current)
+        names = [business['name'] for business in await businesses.find_prefix('name_key', key, 25)]
+        if not names and key:
+            for close in difflib.get_close_matches(key, await businesses.column_values('name_key'), n=25, cutoff=0.6):
+                names.extend(business['name'] for business in await businesses.find('name_key', close))
+        return [app_commands.Choice(name=name, value=name) for name in names[:25]]
 
     @commands.hybrid_command(name='manage_business', description='Manage your business (owner only)')
+    @timed('manage_business')
     async def manage_business(self, ctx):
-        businesses = load_data(BUSINESS_FILE)
-        user_business = None
-        for business in businesses.values():
-            if business['owner_id'] == ctx.author.id:
-                user_business = business
-                break
+        businesses = await get_store(BUSINESS_FILE, guild_of(ctx))
+        owned = await businesses.find('owner_id', ctx.author.id)
+        user_business = owned[0] if owned else None
         if not user_business:
             await ctx.send("❌ You don't own a business! Use `/create_business` to start one.", ephemeral=True)
             return
@@ -181,119 +493,138 @@ class Business(commands.Cog):
         embed.add_field(name="📈 Level", value=user_business['level'], inline=True)
         embed.add_field(name="💰 Work Bonus", value=f"{user_business['work_bonus']}x", inline=True)
         embed.add_field(name="👔 Total Hired", value=user_business['total_employees_hired'], inline=True)
+        embed.add_field(name="💵 Revenue", value=f"${user_business['revenue']:,}", inline=True)
+        pending = await pending_applications(user_business['id'], guild_of(ctx))
+        if pending:
+            embed.set_footer(text=f"{len(pending):,} pending application(s) • Use /applications to review them")
         await ctx.send(embed=embed)
+
+    @commands.hybrid_command(name='applications', description='Review job applications to your business (owner only)')
+    @timed('applications')
+    async def applications(self, ctx):
+        businesses = await get_store(BUSINESS_FILE, guild_of(ctx))
+        owned = await businesses.find('owner_id', ctx.author.id)
+        if not owned:
+            await ctx.send("❌ You don't own a business! Use `/create_business` to start one.", ephemeral=True)
+            return
+        view = ApplicationReviewView(owned[0], ctx.author.id, guild_of(ctx))
+        await view.refresh()
+        await ctx.send(embed=view.render(), view=view, ephemeral=True)
     @commands.hybrid_command(name='upgrade_business', description='Upgrade your business with various improvements')
+    @timed('upgrade_business')
     async def upgrade_business(self, ctx):
-        businesses = load_data(BUSINESS_FILE)
-        user_business = None
-        for business in businesses.values():
-            if business['owner_id'] == ctx.author.id:
-                user_business = business
-                break
+        businesses = await get_store(BUSINESS_FILE, guild_of(ctx))
+        owned = await businesses.find('owner_id', ctx.author.id)
+        user_business = owned[0] if owned else None
         if not user_business:
             await ctx.send("❌ You don't own a business! Use `/create_business` to start one.", ephemeral=True)
             return
-        upgrades = {
-            'premium_office': {'name': 'Premium Office', 'cost': 10000, 'desc': 'Double employee capacity (3→6)'},
-            'employee_benefits': {'name': 'Employee Benefits', 'cost': 7500, 'desc': 'Increase work bonus by 0.5x'},
-            'marketing_boost': {'name': 'Marketing Boost', 'cost': 5000, 'desc': 'Attract more job applicants'},
-            'security_system': {'name': 'Security System', 'cost': 8000, 'desc': 'Protect from theft events'}
-        }
         embed = discord.Embed(
             title=f"🔧 Upgrades for {user_business['name']}",
             description="Invest in your business to make it more profitable!",
             color=0x9932cc
         )
-        for key, info in upgrades.items():
-            status = "✅ Owned" if user_business['upgrades'][key] else f"💰 ${info['cost']:,}"
+        view = discord.ui.View(timeout=None)
+        for key, info in UPGRADES.items():
+            owned = user_business['upgrades'][key]
+            status = "✅ Owned" if owned else f"💰 ${info['cost']:,}"
             embed.add_field(name=f"{info['name']} - {status}", value=info['desc'], inline=False)
-        await ctx.send(embed=embed)
-        await ctx.send("Type the name of the upgrade you wish to purchase (or 'cancel'):")
-        def check(m): return m.author == ctx.author and m.channel == ctx.channel
-        try:
-            msg = await self.bot.wait_for('message', timeout=30, check=check)
-        except asyncio.TimeoutError:
-            await ctx.send("Timed out! Please try again.")
-            return
-        chosen = None
-        for key, info in upgrades.items():
-            if msg.content.lower() == info['name'].lower():
-                chosen = key
-        if not chosen:
-            await ctx.send("Cancelled or not a valid upgrade.")
-            return
-        if user_business['upgrades'][chosen]:
-            await ctx.send("This upgrade has already been purchased!")
-            return
-        user_data = get_user_data(ctx.author.id)
-        cost = upgrades[chosen]['cost']
-        if user_data['balance'] + user_data['bank'] < cost:
-            await ctx.send(f"You need ${cost:,} for this upgrade!\nYour net worth: ${user_data['balance'] + user_data['bank']:,}")
+            if not owned:
+                view.add_item(UpgradeButton(user_business['id'], key))
+        await ctx.send(embed=embed, view=view)
+
+    @timed('purchase_upgrade')
+    async def purchase_upgrade(self, interaction, business_id, chosen):
+        if chosen not in UPGRADES:
+            await interaction.response.send_message("That upgrade doesn't exist any more.", ephemeral=True)
             return
-        if user_data['bank'] >= cost:
-            user_data['bank'] -= cost
-        else:
-            remaining = cost - user_data['bank']
-            user_data['bank'] = 0
-            user_data['balance'] -= remaining
-        user_business['upgrades'][chosen] = True
-        if chosen == 'premium_office':
-            user_business['max_employees'] = 6
-        elif chosen == 'employee_benefits':
-            user_business['work_bonus'] += 0.5
-        businesses[user_business['id']] = user_business
-        update_user_data(ctx.author.id, user_data)
-        save_data(BUSINESS_FILE, businesses)
-        await ctx.send(f"✅ Upgrade purchased! {upgrades[chosen]['desc']}")
+        guild_id = interaction.guild_id
+        businesses = await get_store(BUSINESS_FILE, guild_id)
+        async with bank.locked(users=[interaction.user.id], businesses=[business_id]):
+            user_business = await businesses.get(business_id)
+            if not user_business:
+                await interaction.response.send_message("❌ This business no longer exists.", ephemeral=True)
+                return
+            if user_business['owner_id'] != interaction.user.id:
+                await interaction.response.send_message("❌ Only the owner can buy upgrades for this business.", ephemeral=True)
+                return
+            if user_business['upgrades'][chosen]:
+                await interaction.response.send_message("This upgrade has already been purchased!", ephemeral=True)
+                return
+            user_data = await get_user_data(interaction.user.id, guild_id)
+            cost = UPGRADES[chosen]['cost']
+            paid = bank.charge(user_data, cost)
+            if paid is None:
+                await interaction.response.send_message(
+                    f"You need ${cost:,} for this upgrade!\nYour net worth: ${user_data['balance'] + user_data['bank']:,}",
+                    ephemeral=True)
+                return
+            user_business['upgrades'][chosen] = True
+            if chosen == 'premium_office':
+                user_business['max_employees'] = 6
+            elif chosen == 'employee_benefits':
+                user_business['work_bonus'] += 0.5
+            await businesses.put(user_business['id'], user_business)
+            await update_user_data(interaction.user.id, user_data, guild_id)
+            await ledger.record(interaction.user.id, user_data, 'business_upgrade',
+                                balance=-paid[0], bank=-paid[1], ref=f"{user_business['id']}:{chosen}",
+                                guild_id=guild_id)
+        await interaction.response.send_message(f"✅ Upgrade purchased! {UPGRADES[chosen]['desc']}")
 
     @commands.hybrid_command(name='work', description='Work to earn money')
+    @timed('work')
     async def work(self, ctx):
-        user_data = get_user_data(ctx.author.id)
-        if user_data['last_work']:
-            from datetime import datetime, timedelta
-            last_time = datetime.fromisoformat(user_data['last_work'])
-            if datetime.now() < last_time + timedelta(hours=1):
-                next_time = last_time + timedelta(hours=1)
-                await ctx.send(f"You can work again <t:{int(next_time.timestamp())}:R>")
+        guild_id = guild_of(ctx)
+        businesses = await get_store(BUSINESS_FILE, guild_id)
+        business = None
+        cooldowns = await get_cooldowns(guild_id)
+        async with bank.locked(users=[ctx.author.id]):
+            ready_at = cooldowns.ready_at(ctx.author.id, 'work')
+            if ready_at:
+                await ctx.send(f"You can work again <t:{ready_at}:R>")
                 return
-        work_scenarios = [
-            ("You delivered pizzas around town", random.randint(50, 150)),
-            ("You walked dogs in the neighborhood", random.randint(40, 120)),
-            ("You helped at a local cafe", random.randint(60, 140)),
-            ("You did freelance graphic design", random.randint(80, 200)),
-            ("You tutored students online", random.randint(70, 180)),
-            ("You worked as a cashier", random.randint(45, 130)),
-            ("You did yard work for neighbors", random.randint(55, 160)),
-            ("You worked at a bookstore", random.randint(50, 140)),
-        ]
-        scenario, earnings = random.choice(work_scenarios)
-        total_bonus = 1.0
-        bonus_sources = []
-        job_bonuses = {
-            "Manager": 1.5,
-            "Developer": 1.8,
-            "Teacher": 1.3,
-            "Chef": 1.4,
-            "Artist": 1.2
-        }
-        if user_data['job'] and user_data['job'] in job_bonuses:
-            job_bonus = job_bonuses[user_data['job']]
-            total_bonus *= job_bonus
-            bonus_sources.append(f"Job ({user_data['job']}): {job_bonus}x")
-        if user_data['business_job']:
-            businesses = load_data(BUSINESS_FILE)
-            business = businesses.get(user_data['business_job']['business_id'])
-            if business:
-                business_bonus = business['work_bonus']
-                total_bonus *= business_bonus
-                bonus_sources.append(f"Business ({business['name']}): {business_bonus}x")
-                if str(ctx.author.id) in business['employees']:
+            user_data = await get_user_data(ctx.author.id, guild_id)
+            work_scenarios = [
+                ("You delivered pizzas around town", random.randint(50, 150)),
+                ("You walked dogs in the neighborhood", random.randint(40, 120)),
+                ("You helped at a local cafe", random.randint(60, 140)),
+                ("You did freelance graphic design", random.randint(80, 200)),
+                ("You tutored students online", random.randint(70, 180)),
+                ("You worked as a cashier", random.randint(45, 130)),
+                ("You did yard work for neighbors", random.randint(55, 160)),
+                ("You worked at a bookstore", random.randint(50, 140)),
+            ]
+            scenario, earnings = random.choice(work_scenarios)
+            total_bonus = 1.0
+            bonus_sources = []
+            job_bonuses = {
+                "Manager": 1.5,
+                "Developer": 1.8,
+                "Teacher": 1.3,
+                "Chef": 1.4,
+                "Artist": 1.2
+            }
+            if user_data['job'] and user_data['job'] in job_bonuses:
+                job_bonus = job_bonuses[user_data['job']]
+                total_bonus *= job_bonus
+                bonus_sources.append(f"Job ({user_data['job']}): {job_bonus}x")
+            if user_data['business_job']:
+                business = await businesses.get(user_data['business_job']['business_id'])
+                if business:
+                    business_bonus = business['work_bonus']
+                    total_bonus *= business_bonus
+                    bonus_sources.append(f"Business ({business['name']}): {business_bonus}x")
+            final_earnings = floor(earnings * total_bonus)
+            user_data['balance'] += final_earnings
+            await update_user_data(ctx.author.id, user_data, guild_id)
+            await ledger.record(ctx.author.id, user_data, 'work', balance=final_earnings, guild_id=guild_id)
+            await cooldowns.start(ctx.author.id, 'work', setting(guild_id, 'WORK_COOLDOWN'))
+        if business and str(ctx.author.id) in business['employees']:
+            async with bank.locked(businesses=[business['id']]):
+                business = await businesses.get(business['id'])
+                if business and str(ctx.author.id) in business['employees']:
                     business['employees'][str(ctx.author.id)]['total_work_sessions'] += 1
-                    save_data(BUSINESS_FILE, businesses)
-        final_earnings = floor(earnings * total_bonus)
-        user_data['balance'] += final_earnings
-        user_data['last_work'] = datetime.now().isoformat()
-        update_user_data(ctx.author.id, user_data)
+                    await businesses.put(business['id'], business)
         embed = discord.Embed(
             title="💼 You Worked!",
             description=f"{scenario} and earned **${final_earnings:,}**!",
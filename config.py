@@ -2,4 +2,46 @@ TOKEN = 'YOUR TOKEN HERE'
 ECONOMY_FILE = 'economy_data.json'
 BUSINESS_FILE = 'business_data.json'
 APPLICATIONS_FILE = 'applications_data.json'
-ADD_MONEY_ROLE_ID = 1388148661707477002
\ No newline at end of file
+COOLDOWN_FILE = 'cooldowns_data.json'
+ROULETTE_FILE = 'roulette_data.json'
+ADD_MONEY_ROLE_ID = 1388148661707477002
+BUSINESS_CREATION_FEE = 5000
+ECONOMY_SCOPE = 'guild'  # 'guild' gives every server its own economy and data files, 'global' shares one between them
+GUILD_DATA_DIR = 'guilds'  # each server's data files, in a directory named after its id
+GUILD_IDLE_TIMEOUT = 900  # seconds a server's economy stays open after its last command
+GUILD_WARM_LIMIT = 50  # largest servers whose economies each bot process loads once it's ready
+GUILD_SETTINGS = {}  # server id -> {name: value} overriding ADD_MONEY_ROLE_ID, BUSINESS_CREATION_FEE, WORK_COOLDOWN or ROB_COOLDOWN there
+FLUSH_INTERVAL = 30  # seconds between write-backs of cached data
+FLUSH_THRESHOLD = 500  # pending records that force an early write-back
+STORAGE_BACKEND = 'json'  # 'json' for small installs, 'sqlite' for large ones
+DATABASE_FILE = 'economy.db'
+WORK_COOLDOWN = 3600  # seconds
+ROB_COOLDOWN = 3600  # seconds
+ROULETTE_ROUND_SECONDS = 30  # a round closes this long after its first bet
+ROULETTE_REFUND_AFTER = 600  # rounds overdue by more than this at startup are refunded, not spun
+STATS_ENABLED = True  # per-command latency and storage counters, shown by /stats
+STATS_FILE = 'stats.json'
+STATS_DUMP_INTERVAL = 300  # seconds
+STATS_SAMPLES = 1000  # latency samples kept per command
+SHARD_COUNT = 1  # Discord shards; with more than one, start the bot with launcher.py instead of main.py
+WORKER_COUNT = 1  # bot processes launcher.py spreads the shards across
+STORAGE_SOCKET = 'storage.sock'  # Unix socket of the storage daemon in sharded mode
+LEDGER_FILE = 'ledger.jsonl'  # balance changes since the last snapshot
+LEDGER_ARCHIVE_FILE = 'ledger_archive.jsonl'  # older entries, kept as the audit trail
+LEDGER_COMPACT_INTERVAL = 300  # seconds between snapshots that move entries to the archive
+APPLICATION_ARCHIVE_FILE = 'applications_archive.jsonl'  # resolved applications, appended and never loaded
+APPLICATION_EXPIRY_DAYS = 14  # pending applications older than this are expired
+PAYROLL_INTERVAL = 3600  # seconds between business revenue and payroll ticks
+REVENUE_PER_LEVEL = 100  # each business earns this per level every tick
+REVENUE_PER_EMPLOYEE = 150  # plus this per employee
+EMPLOYEE_WAGE = 100  # paid to each employee every tick, times the business's work bonus
+NAME_CACHE_SIZE = 10000  # users fetched over REST whose names are kept
+NAME_CACHE_TTL = 3600  # seconds a fetched name is trusted
+NAME_REFRESH_INTERVAL = 600  # seconds between updates of renamed owners' businesses
+COMMAND_HASH_FILE = 'commands.hash'  # hash of the last synced slash commands; delete it to force a sync
+RATE_LIMITS = {'light': (30, 10), 'heavy': (6, 3)}  # cost class -> (commands per minute, burst) per user
+GUILD_RATE_LIMITS = {'light': (600, 100), 'heavy': (120, 30)}  # the same per server, shared by its members
+COMMAND_COSTS = {'top': 'heavy', 'business': 'heavy', 'applications': 'heavy', 'stats': 'heavy'}  # others are 'light'
+OVERLOAD_LAG = 0.25  # seconds the event loop may lag before the bot counts as overloaded
+OVERLOAD_SHED = ('heavy',)  # cost classes refused while overloaded
+TOP_CACHE_TTL = 60  # seconds a rendered /top page can be served to refused calls
\ No newline at end of file
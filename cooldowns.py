@@ -0,0 +1,129 @@
+# cooldowns.py
+#
+# Per-(user, action) cooldowns kept as epoch-second expiry times in memory, so
+# a command that is still cooling down is turned away without reading the
+# user's record. Every change is also written to COOLDOWN_FILE through the
+# storage layer so cooldowns survive restarts. Each server's economy has its
+# own (see guilds.py).
+
+import asyncio
+import time
+from datetime import datetime
+from storage import get_store, loaded_stores, borrow, subscribe_evictions
+from guilds import partition
+from config import COOLDOWN_FILE, ECONOMY_FILE
+
+# Marker record noting that last_work/last_rob have been imported from the
+# user records, so that only happens once.
+LEGACY_MARKER = '__legacy_imported__'
+LEGACY_FIELDS = {'work': 'last_work', 'rob': 'last_rob'}
+LEGACY_DURATION = 3600
+
+class Cooldowns:
+    def __init__(self, store, guild_id=None):
+        self.store = store
+        self.guild_id = guild_id
+        self.expiry = {}
+
+    async def load(self):
+        now = int(time.time())
+        expired = []
+        for key, record in await self.store.items():
+            if key == LEGACY_MARKER:
+                continue
+            if record['expires_at'] <= now:
+                expired.append(key)
+                continue
+            user_id, action = key.split(':', 1)
+            self.expiry[(user_id, action)] = record['expires_at']
+        # Other worker processes start cooldowns too in a sharded deployment.
+        self.store.subscribe(self._on_change)
+        for key in expired:
+            await self.store.delete(key)
+        if not await self.store.contains(LEGACY_MARKER):
+            await self._import_legacy(now)
+
+    def _on_change(self, key, record):
+        if key == LEGACY_MARKER:
+            return
+        user_id, action = key.split(':', 1)
+        if record is None:
+            self.expiry.pop((user_id, action), None)
+        else:
+            self.expiry[(user_id, action)] = record['expires_at']
+
+    # Earlier versions stored naive local-time ISO strings on the user record.
+    async def _import_legacy(self, now):
+        users = await get_store(ECONOMY_FILE, self.guild_id)
+        for user_id, user_data in await users.items():
+            for action, field in LEGACY_FIELDS.items():
+                if not user_data.get(field):
+                    continue
+                expires_at = int(datetime.fromisoformat(user_data[field]).timestamp()) + LEGACY_DURATION
+                if expires_at > now and (user_id, action) not in self.expiry:
+                    self.expiry[(user_id, action)] = expires_at
+                    await self.store.put(f'{user_id}:{action}', {'expires_at': expires_at})
+        await self.store.put(LEGACY_MARKER, {'expires_at': 0})
+
+    # Epoch second at which `action` is available again, or None if it is.
+    def ready_at(self, user_id, action):
+        expires_at = self.expiry.get((str(user_id), action))
+        if expires_at is None:
+            return None
+        if expires_at <= time.time():
+            return None
+        return expires_at
+
+    async def start(self, user_id, action, seconds):
+        user_id = str(user_id)
+        expires_at = int(time.time()) + seconds
+        self.expiry[(user_id, action)] = expires_at
+        await self.store.put(f'{user_id}:{action}', {'expires_at': expires_at})
+
+    async def purge_expired(self):
+        now = time.time()
+        expired = [key for key, expires_at in self.expiry.items() if expires_at <= now]
+        for user_id, action in expired:
+            del self.expiry[(user_id, action)]
+            await self.store.delete(f'{user_id}:{action}')
+        return len(expired)
+
+_cooldowns = {}  # partition -> Cooldowns
+_loading = {}
+
+async def get_cooldowns(guild_id=None):
+    part = partition(guild_id)
+    await get_store(COOLDOWN_FILE, part)  # a use of the server (see storage.py)
+    cooldowns = _cooldowns.get(part)
+    if cooldowns is None:
+        loading = _loading.get(part)
+        if loading is None:
+            loading = _loading[part] = asyncio.ensure_future(_load_cooldowns(part))
+        cooldowns = _cooldowns[part] = await asyncio.shield(loading)
+    return cooldowns
+
+async def _load_cooldowns(part):
+    cooldowns = Cooldowns(await get_store(COOLDOWN_FILE, part), part)
+    await cooldowns.load()
+    return cooldowns
+
+# Loaded again on the server's next use (see storage.evict()).
+def _evicted(part):
+    _cooldowns.pop(part, None)
+    _loading.pop(part, None)
+
+subscribe_evictions(_evicted)
+
+# Only servers whose cooldowns are open get purged (in the storage daemon,
+# those some worker has used); load() drops the expired ones of any other
+# server when it next gets used.
+async def purge_loop(interval=3600):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            for part, store in loaded_stores(COOLDOWN_FILE):
+                async with borrow(part):
+                    cooldowns = await get_cooldowns(part)
+                    await cooldowns.purge_expired()
+        except Exception as e:
+            print(f'Failed to purge cooldowns: {e}')
@@ -2,22 +2,45 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 import random
-import asyncio
-from datetime import datetime, timedelta
-from storage import get_user_data, update_user_data, load_data
+import time
+from datetime import datetime, timezone
+from collections import OrderedDict
+from storage import get_user_data, update_user_data
+from guilds import setting
 from config import *
 from math import floor
+import bank
+import ledger
+from leaderboard import get_leaderboard
+from cooldowns import get_cooldowns
+from names import get_names
+from ratelimit import get_admission
+from roulette import RouletteEngine, AlreadyBetting
+import stats
+from stats import timed
+
+TOP_CACHE_SIZE = 200  # rendered /top pages kept for refused calls
 
 class Economy(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.active_roulette = {}
+        self.roulette_table = RouletteEngine(bot)
+        self.names = get_names(bot)
+        self.top_pages = OrderedDict()  # (guild id, page) -> (embed without footer, page count, rendered at)
+        get_admission(bot).fallback('top', self.cached_top)
+
+    async def cog_load(self):
+        await self.roulette_table.start()
+
+    async def cog_unload(self):
+        self.roulette_table.stop()
 
     # ======= BALANCE =======
     @app_commands.command(name='bal', description="Check your or someone else's balance")
+    @timed('bal')
     async def bal(self, interaction: discord.Interaction, user: discord.User = None):
         user = user or interaction.user
-        user_data = get_user_data(user.id)
+        user_data = await get_user_data(user.id, interaction.guild_id)
         embed = discord.Embed(
             title=f"💰 Balance for {user.display_name}",
             description=f"Wallet: ${user_data['balance']:,}\nBank: ${user_data['bank']:,}\nNet Worth: ${user_data['balance'] + user_data['bank']:,}",
@@ -27,67 +50,92 @@ class Economy(commands.Cog):
 
     # ======= LEADERBOARD =======
     @app_commands.command(name='top', description='Show the richest users')
-    async def top(self, interaction: discord.Interaction):
-        data = load_data(ECONOMY_FILE)
-        if not data:
+    @timed('top')
+    async def top(self, interaction: discord.Interaction, page: int = 1):
+        leaderboard = await get_leaderboard(interaction.guild_id)
+        if not leaderboard:
             await interaction.response.send_message("No users found!", ephemeral=True)
             return
-        leaderboard = sorted(data.items(), key=lambda item: item[1]['balance'] + item[1]['bank'], reverse=True)[:10]
+        pages = (len(leaderboard) + 9) // 10
+        page = min(max(page, 1), pages)
+        entries = leaderboard.page((page - 1) * 10 + 1, 10)
+        names = await self.names.names([user_id for _, user_id, _ in entries], interaction.guild)
         embed = discord.Embed(
-            title="💸 Top 10 Richest Users",
+            title="💸 Top 10 Richest Users" if page == 1 else f"💸 Richest Users (Page {page}/{pages})",
             color=0xffd700
         )
-        for idx, (user_id, user_data) in enumerate(leaderboard, 1):
-            try:
-                member = await self.bot.fetch_user(int(user_id))
-                name = member.display_name
-            except Exception:
-                name = f"User {user_id}"
-            net = user_data['balance'] + user_data['bank']
+        for rank, user_id, net in entries:
+            user_data = await get_user_data(user_id, interaction.guild_id)
             embed.add_field(
-                name=f"{idx}. {name}",
+                name=f"{rank}. {names[user_id]}",
                 value=f"Balance: ${user_data['balance']:,} | Bank: ${user_data['bank']:,} | Net: ${net:,}",
                 inline=False
             )
+        self.top_pages[(interaction.guild_id, page)] = (embed.copy(), pages, time.time())
+        self.top_pages.move_to_end((interaction.guild_id, page))
+        while len(self.top_pages) > TOP_CACHE_SIZE:
+            self.top_pages.popitem(last=False)
+        footer = f"Page {page}/{pages}"
+        own_rank = leaderboard.rank(interaction.user.id)
+        if own_rank:
+            footer += f" • Your rank: #{own_rank:,} of {len(leaderboard):,}"
+        embed.set_footer(text=footer)
         await interaction.response.send_message(embed=embed)
 
+    # Answers a /top call refused by admission control with the same page as
+    # rendered for this server in the last TOP_CACHE_TTL seconds, if there is
+    # one.
+    async def cached_top(self, interaction):
+        page = next((option['value'] for option in interaction.data.get('options', ()) if option['name'] == 'page'), 1)
+        cached = self.top_pages.get((interaction.guild_id, max(page, 1)))
+        if cached is None or time.time() - cached[2] > TOP_CACHE_TTL:
+            return False
+        embed, pages, rendered_at = cached
+        embed = embed.copy()
+        embed.set_footer(text=f"Page {max(page, 1)}/{pages} • Cached")
+        embed.timestamp = datetime.fromtimestamp(rendered_at, timezone.utc)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return True
+
     # ======= ROB =======
     @app_commands.command(name='rob', description="Rob another user")
+    @timed('rob')
     async def rob(self, interaction: discord.Interaction, target: discord.User):
         if target.id == interaction.user.id:
             await interaction.response.send_message("You can't rob yourself!", ephemeral=True)
             return
-        user_data = get_user_data(interaction.user.id)
-        target_data = get_user_data(target.id)
-        if user_data['balance'] < 100:
-            await interaction.response.send_message("You need at least $100 in your wallet to rob someone!", ephemeral=True)
-            return
-        if target_data['balance'] < 100:
-            await interaction.response.send_message(f"{target.display_name} doesn't have enough money to rob!", ephemeral=True)
-            return
-        if user_data.get('last_rob'):
-            last_time = datetime.fromisoformat(user_data['last_rob'])
-            if datetime.now() < last_time + timedelta(hours=1):
-                next_time = last_time + timedelta(hours=1)
-                await interaction.response.send_message(f"You can rob again <t:{int(next_time.timestamp())}:R>", ephemeral=True)
+        guild_id = interaction.guild_id
+        cooldowns = await get_cooldowns(guild_id)
+        async with bank.locked(users=[interaction.user.id, target.id]):
+            ready_at = cooldowns.ready_at(interaction.user.id, 'rob')
+            if ready_at:
+                await interaction.response.send_message(f"You can rob again <t:{ready_at}:R>", ephemeral=True)
+                return
+            user_data = await get_user_data(interaction.user.id, guild_id)
+            target_data = await get_user_data(target.id, guild_id)
+            if user_data['balance'] < 100:
+                await interaction.response.send_message("You need at least $100 in your wallet to rob someone!", ephemeral=True)
                 return
-        success = random.random() < 0.45
-        if success:
-            amount = random.randint(50, min(300, target_data['balance']))
-            user_data['balance'] += amount
-            target_data['balance'] -= amount
-            result = f"💸 Success! You stole ${amount:,} from {target.display_name}!"
-        else:
-            amount = random.randint(25, min(200, user_data['balance']))
-            user_data['balance'] -= amount
-            result = f"🚨 You got caught! You paid ${amount:,} as a fine."
-        user_data['last_rob'] = datetime.now().isoformat()
-        update_user_data(interaction.user.id, user_data)
-        update_user_data(target.id, target_data)
-        await interaction.response.send_message(result)
+            if target_data['balance'] < 100:
+                await interaction.response.send_message(f"{target.display_name} doesn't have enough money to rob!", ephemeral=True)
+                return
+            if random.random() < 0.45:
+                amount = random.randint(50, min(300, target_data['balance']))
+                await bank.transfer(target.id, interaction.user.id, amount, 'rob', guild_id,
+                                    records=(target_data, user_data))
+                result = f"💸 Success! You stole ${amount:,} from {target.display_name}!"
+            else:
+                amount = random.randint(25, min(200, user_data['balance']))
+                user_data['balance'] -= amount
+                await update_user_data(interaction.user.id, user_data, guild_id)
+                await ledger.record(interaction.user.id, user_data, 'rob_fine', balance=-amount, guild_id=guild_id)
+                result = f"🚨 You got caught! You paid ${amount:,} as a fine."
+            await cooldowns.start(interaction.user.id, 'rob', setting(guild_id, 'ROB_COOLDOWN'))
+            await interaction.response.send_message(result)
 
     # ======= ROULETTE =======
-    @app_commands.command(name="roulette", description="Bet at least $100 on red or black. Result in 30 seconds!")
+    @app_commands.command(name="roulette", description="Bet at least $100 on red or black. Result within 30 seconds!")
+    @timed('roulette')
     async def roulette(self, interaction: discord.Interaction, color: str, amount: int):
         color = color.lower()
         if color not in ("red", "black"):
@@ -96,55 +144,72 @@ class Economy(commands.Cog):
         if amount < 100:
             await interaction.response.send_message("Minimum bet is $100.", ephemeral=True)
             return
-        user_data = get_user_data(interaction.user.id)
-        if user_data['balance'] < amount:
-            await interaction.response.send_message("You don't have enough money in your wallet!", ephemeral=True)
-            return
-        if interaction.user.id in self.active_roulette:
+        try:
+            resolves_at = await self.roulette_table.place_bet(
+                interaction.user.id, interaction.guild_id, interaction.channel_id, color, amount)
+        except AlreadyBetting:
             await interaction.response.send_message("You already have an active roulette bet! Wait for it to finish.", ephemeral=True)
             return
-        user_data['balance'] -= amount
-        update_user_data(interaction.user.id, user_data)
-        self.active_roulette[interaction.user.id] = (color, amount)
+        except bank.InsufficientFunds:
+            await interaction.response.send_message("You don't have enough money in your wallet!", ephemeral=True)
+            return
         embed = discord.Embed(
             title="🎰 Roulette",
-            description=f"{interaction.user.display_name} bets **${amount:,}** on **{color.upper()}**!\n\nResult in 30 seconds...",
+            description=f"{interaction.user.display_name} bets **${amount:,}** on **{color.upper()}**!\n\nThe wheel spins <t:{resolves_at}:R>...",
             color=0xd72631 if color == "red" else 0x111111
         )
         await interaction.response.send_message(embed=embed)
-        await asyncio.sleep(30)
-        winning_color = random.choice(["red", "black"])
-        del self.active_roulette[interaction.user.id]
-        if color == winning_color:
-            user_data = get_user_data(interaction.user.id)
-            winnings = amount * 2
-            user_data['balance'] += winnings
-            update_user_data(interaction.user.id, user_data)
-            result_text = f"🎉 The ball has chosen **{winning_color.upper()}**!\nYou won **${winnings:,}**!"
-        else:
-            result_text = f"😢 The ball has chosen **{winning_color.upper()}**.\nYou lost your **${amount:,}** bet."
-        await interaction.followup.send(result_text, ephemeral=True)
 
     # ======= ADMIN: ADD MONEY (role-based) =======
     @app_commands.command(name="add_money", description="Give money to a user (requires special role)")
+    @timed('add_money')
     async def add_money(self, interaction: discord.Interaction, user: discord.User, amount: int):
-        guild = interaction.guild
-        member = guild.get_member(interaction.user.id)
-        if not member:
-            await interaction.response.send_message("Could not verify your role.", ephemeral=True)
-            return
-        if ADD_MONEY_ROLE_ID not in [role.id for role in member.roles]:
-            await interaction.response.send_message(
-                "You don't have permission to use this command.", ephemeral=True)
+        if not await self.check_admin(interaction):
             return
         if amount <= 0:
             await interaction.response.send_message("Amount must be greater than 0.", ephemeral=True)
             return
-        user_data = get_user_data(user.id)
-        user_data['balance'] += amount
-        update_user_data(user.id, user_data)
+        user_data = await bank.adjust_balance(user.id, amount, 'add_money', ref=str(interaction.user.id),
+                                              guild_id=interaction.guild_id)
         await interaction.response.send_message(
             f"Gave ${amount:,} to {user.display_name}. New balance: ${user_data['balance']:,}")
 
+    # ======= ADMIN: STATS (role-based) =======
+    @app_commands.command(name="stats", description="Show bot performance stats (requires special role)")
+    async def stats(self, interaction: discord.Interaction):
+        if not await self.check_admin(interaction):
+            return
+        if not STATS_ENABLED:
+            await interaction.response.send_message("Stats are disabled (`STATS_ENABLED` in config.py).", ephemeral=True)
+            return
+        snapshot = stats.snapshot()
+        lines = [f"{'name':<26}{'calls':>8}{'p50':>9}{'p95':>9}{'p99':>9}"]
+        for name, latency in sorted(snapshot['latency'].items()):
+            lines.append(f"{name:<26}{latency['calls']:>8,}"
+                         + "".join(f"{latency[p] * 1000:>7.1f}ms" for p in ('p50', 'p95', 'p99')))
+        counters = snapshot['counters']
+        hit_rate = snapshot['cache_hit_rate']
+        embed = discord.Embed(title="📊 Bot Stats", color=0x0099ff)
+        embed.description = "```\n" + "\n".join(lines)[:3900] + "\n```"
+        embed.add_field(name="Storage Reads", value=f"{counters.get('storage.reads', 0):,}", inline=True)
+        embed.add_field(name="Storage Writes", value=f"{counters.get('storage.writes', 0):,}", inline=True)
+        embed.add_field(name="Flushes", value=f"{counters.get('storage.flushes', 0):,}", inline=True)
+        embed.add_field(name="Bytes Serialized", value=f"{counters.get('storage.bytes_written', 0):,}", inline=True)
+        embed.add_field(name="Cache Hit Rate", value="n/a" if hit_rate is None else f"{hit_rate:.1%}", inline=True)
+        embed.add_field(name="Uptime", value=f"{snapshot['uptime'] / 3600:.1f}h", inline=True)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    async def check_admin(self, interaction):
+        guild = interaction.guild
+        member = guild.get_member(interaction.user.id) if guild else None
+        if not member:
+            await interaction.response.send_message("Could not verify your role.", ephemeral=True)
+            return False
+        if setting(guild.id, 'ADD_MONEY_ROLE_ID') not in [role.id for role in member.roles]:
+            await interaction.response.send_message(
+                "You don't have permission to use this command.", ephemeral=True)
+            return False
+        return True
+
 async def setup(bot):
     await bot.add_cog(Economy(bot))
@@ -0,0 +1,44 @@
+# guilds.py
+#
+# Per-server economies. With ECONOMY_SCOPE = 'guild' every server is its own
+# partition of the data: a directory GUILD_DATA_DIR/<server id>/ with its own
+# copy of every data file (or its own database, with the SQLite backend), its
+# own leaderboard, cooldowns and businesses. Commands in one server never load
+# or rewrite another server's files. With ECONOMY_SCOPE = 'global' every server
+# shares the top-level files, as before. Commands used in DMs always work on
+# the top-level files.
+#
+# GUILD_SETTINGS overrides the add_money role, fees and cooldowns for single
+# servers, in either mode.
+
+import os
+import config
+from config import ECONOMY_SCOPE, GUILD_DATA_DIR, GUILD_SETTINGS
+
+# The partition a server's data lives in: its id as a string, or None for the
+# top-level files. Passing a partition back in returns it unchanged.
+def partition(guild_id):
+    if ECONOMY_SCOPE == 'global' or guild_id is None:
+        return None
+    return str(guild_id)
+
+def partition_path(filename, part):
+    if part is None:
+        return filename
+    return os.path.join(GUILD_DATA_DIR, part, filename)
+
+# Partitions with data on disk, the top-level files first.
+def stored_partitions():
+    found = [None]
+    if ECONOMY_SCOPE == 'guild':
+        try:
+            names = os.listdir(GUILD_DATA_DIR)
+        except FileNotFoundError:
+            names = []
+        found.extend(sorted(name for name in names if name.isdigit()))
+    return found
+
+# A config.py setting as it applies in one server.
+def setting(guild_id, name):
+    overrides = GUILD_SETTINGS.get(int(guild_id), {}) if guild_id is not None else {}
+    return overrides.get(name, getattr(config, name))
@@ -0,0 +1,77 @@
+# launcher.py
+#
+# Sharded deployment: starts the storage daemon, waits until it accepts
+# connections, then starts WORKER_COUNT bot processes that split SHARD_COUNT
+# shards between them.
+# The workers share all data through the daemon, so balances, locks,
+# cooldowns and leaderboards are the same whichever process handles a command.
+# On Ctrl-C the workers flush and exit first; the daemon is stopped last.
+
+import asyncio
+import multiprocessing
+import os
+import socket
+import time
+from config import SHARD_COUNT, WORKER_COUNT, STORAGE_SOCKET
+
+SOCKET_TIMEOUT = 30  # seconds to wait for the daemon to start listening
+
+# Whether something accepts connections on the socket. A socket file left
+# behind by a daemon that crashed exists but refuses them.
+def daemon_listening():
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(STORAGE_SOCKET)
+        except OSError:
+            return False
+    return True
+
+def run_storage_daemon():
+    import storage_server
+    asyncio.run(storage_server.serve(STORAGE_SOCKET))
+
+def run_worker(shard_ids):
+    import main
+    try:
+        asyncio.run(main.main(shard_ids, SHARD_COUNT))
+    except KeyboardInterrupt:
+        pass
+
+def main():
+    if daemon_listening():
+        raise SystemExit('Another storage daemon is already running.')
+    try:
+        os.remove(STORAGE_SOCKET)
+    except FileNotFoundError:
+        pass
+    context = multiprocessing.get_context('spawn')
+    daemon = context.Process(target=run_storage_daemon, name='storage')
+    daemon.start()
+    deadline = time.monotonic() + SOCKET_TIMEOUT
+    while not daemon_listening():
+        if not daemon.is_alive() or time.monotonic() > deadline:
+            daemon.terminate()
+            raise SystemExit('Storage daemon failed to start.')
+        time.sleep(0.1)
+
+    workers = []
+    for index in range(WORKER_COUNT):
+        shard_ids = list(range(index, SHARD_COUNT, WORKER_COUNT))
+        if not shard_ids:
+            continue
+        worker = context.Process(target=run_worker, args=(shard_ids,), name=f'worker-{index}')
+        worker.start()
+        print(f'Started worker {index} with shards {shard_ids}')
+        workers.append(worker)
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.join()
+    finally:
+        daemon.terminate()
+        daemon.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# leaderboard.py
+#
+# Net-worth ranking of every user, kept sorted as balances change so /top only
+# reads the page it shows instead of sorting the whole economy on every call.
+# Each server's economy has its own (see guilds.py).
+
+import bisect
+from storage import get_store, net_worth, subscribe_evictions
+from guilds import partition
+from config import ECONOMY_FILE
+
+REBUILD_AFTER = 1000  # queued changes past which a full re-sort beats inserting them one by one
+
+class Leaderboard:
+    def __init__(self, users):
+        self.net_worth = {}
+        self.entries = []  # (-net worth, user id), ascending = richest first
+        self.changed = {}  # user id -> new net worth (None if deleted), not yet in entries
+        for user_id, user_data in users:
+            net = net_worth(user_data)
+            self.net_worth[user_id] = net
+            self.entries.append((-net, user_id))
+        self.entries.sort()
+
+    def __len__(self):
+        self._apply()
+        return len(self.entries)
+
+    # Changes are only queued here and sorted in on the next read, so a batch
+    # touching most users (the payroll tick) costs one sort, not one list
+    # insert per user.
+    def update(self, user_id, user_data):
+        self.changed[user_id] = None if user_data is None else net_worth(user_data)
+
+    def _apply(self):
+        if not self.changed:
+            return
+        changed, self.changed = self.changed, {}
+        if len(changed) > REBUILD_AFTER:
+            for user_id, new in changed.items():
+                if new is None:
+                    self.net_worth.pop(user_id, None)
+                else:
+                    self.net_worth[user_id] = new
+            self.entries = sorted((-net, user_id) for user_id, net in self.net_worth.items())
+            return
+        for user_id, new in changed.items():
+            old = self.net_worth.get(user_id)
+            if old == new:
+                continue
+            if old is not None:
+                del self.entries[bisect.bisect_left(self.entries, (-old, user_id))]
+                del self.net_worth[user_id]
+            if new is not None:
+                bisect.insort(self.entries, (-new, user_id))
+                self.net_worth[user_id] = new
+
+    # Returns [(rank, user_id, net_worth)] for `count` users starting at the
+    # 1-based rank `start`.
+    def page(self, start, count):
+        self._apply()
+        entries = self.entries[start - 1:start - 1 + count]
+        return [(start + i, user_id, -neg_net) for i, (neg_net, user_id) in enumerate(entries)]
+
+    def rank(self, user_id):
+        self._apply()
+        user_id = str(user_id)
+        net = self.net_worth.get(user_id)
+        if net is None:
+            return None
+        return bisect.bisect_left(self.entries, (-net, user_id)) + 1
+
+_leaderboards = {}  # partition -> Leaderboard
+
+async def get_leaderboard(guild_id=None):
+    part = partition(guild_id)
+    store = await get_store(ECONOMY_FILE, part)
+    leaderboard = _leaderboards.get(part)
+    if leaderboard is None:
+        users = await store.items()
+        # Nothing can be written between items() returning and subscribe(),
+        # so the index never misses an update. Two concurrent first calls
+        # both load, and the first to finish wins.
+        leaderboard = _leaderboards.get(part)
+        if leaderboard is None:
+            leaderboard = _leaderboards[part] = Leaderboard(users)
+            store.subscribe(leaderboard.update)
+    return leaderboard
+
+# Built again on the server's next use (see storage.evict()).
+subscribe_evictions(lambda part: _leaderboards.pop(part, None))
@@ -0,0 +1,251 @@
+# ledger.py
+#
+# Append-only history of every balance change, one JSON array per line in
+# LEDGER_FILE:
+#
+#     [seq, time, user id, wallet delta, bank delta, wallet after, bank after, reason, ref, server id]
+#
+# The server id (null for DMs, and in entries from before economies were per
+# server) says which economy the balances belong to; see guilds.py. Bulk
+# credits (the payroll tick) are logged as one combined entry per batch
+# instead, with the user fields null and a list per field at the end:
+#
+#     [seq, time, null, null, null, null, null, reason, ref, server id,
+#      [user ids], [wallet deltas], [bank deltas], [wallets after], [banks after]]
+#
+# An append costs one short write however big the economy is, and the ledger
+# doubles as an audit trail (add_money entries carry the admin's id as ref).
+#
+# The economy data is still written back in the background as before; each
+# write-back is a snapshot. replay() runs at startup and re-applies whatever
+# is left in the active ledger, so changes made after the last snapshot
+# survive a crash. compact() takes a fresh snapshot and moves the entries it
+# covers to LEDGER_ARCHIVE_FILE. Entries carry the resulting balances, not
+# just the deltas, so replaying one the snapshot already has changes nothing.
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+import stats
+from storage import get_user_data, update_users, run_io, remote_client, loaded_stores
+from guilds import partition
+from config import ECONOMY_FILE, LEDGER_FILE, LEDGER_ARCHIVE_FILE, LEDGER_COMPACT_INTERVAL
+
+_seq = None  # last sequence number handed out
+_loading = None
+_file = None  # append handle, only touched on the storage thread
+
+# Logs one user's change. `user_data` is the record as saved; `balance` and
+# `bank` are what this change added to the wallet and the bank.
+async def record(user_id, user_data, reason, balance=0, bank=0, ref=None, guild_id=None):
+    await record_many([(user_id, user_data, balance, bank)], reason, ref, guild_id)
+
+# Logs several (user_id, user_data, balance delta, bank delta) changes with
+# one write. Call while still holding the users' locks, after saving them.
+async def record_many(changes, reason, ref=None, guild_id=None):
+    await record_batches([(changes, reason, ref)], guild_id)
+
+# Logs several (changes, reason, ref) batches with one write. Their sequence
+# numbers are handed out together, before anything else gets to run, so
+# changes saved without holding the locks can be logged this way too if it's
+# done straight after saving them. Every batch is in the same server's economy.
+@stats.timed('ledger.record')
+async def record_batches(batches, guild_id=None):
+    batches = [([[str(user_id), balance, bank, user_data['balance'], user_data['bank']]
+                 for user_id, user_data, balance, bank in changes], reason, ref)
+               for changes, reason, ref in batches]
+    await _log([batch for batch in batches if batch[0]], guild_id)
+
+# Logs changes to several users as one combined entry, given as a list per
+# field: user ids (strings), wallet deltas, bank deltas, wallets after and
+# banks after. For bulk credits, where a line per user would be most of the
+# cost. Same rules as record_batches otherwise.
+@stats.timed('ledger.record')
+async def record_combined(columns, reason, ref=None, guild_id=None):
+    if columns[0]:
+        await _log([(columns, reason, ref)], guild_id, combined=True)
+
+async def _log(batches, guild_id, combined=False):
+    if not batches:
+        return
+    guild = None if guild_id is None else str(guild_id)
+    client = remote_client()
+    if client is not None:
+        # The storage daemon owns the ledger in a sharded deployment.
+        await client.call('ledger', None, batches, guild, combined)
+    else:
+        await append(batches, guild, combined)
+
+async def append(batches, guild=None, combined=False):
+    global _seq
+    if _seq is None:
+        await _load_seq()
+    now = int(time.time())
+    lines = []
+    for entries, reason, ref in batches:
+        # Formatted by hand, json.dumps per line is most of the cost of logging
+        # a batch. User ids are Discord snowflakes, the amounts numbers.
+        tail = json.dumps([reason, ref, guild], separators=(',', ':'))[1:]
+        if combined:
+            _seq += 1
+            columns = json.dumps(entries, separators=(',', ':'))[1:]
+            lines.append(f'[{_seq},{now},null,null,null,null,null,{tail[:-1]},{columns}\n')
+            continue
+        for user_id, balance, bank, balance_after, bank_after in entries:
+            _seq += 1
+            lines.append(f'[{_seq},{now},"{user_id}",{balance},{bank},{balance_after},{bank_after},{tail}\n')
+    # Sequence numbers are taken before this await and the storage thread
+    # runs jobs in order, so lines always land in sequence order.
+    await run_io(_write, lines)
+
+def _write(lines):
+    global _file
+    if _file is None:
+        _file = open(LEDGER_FILE, 'a')
+    data = ''.join(lines)
+    _file.write(data)
+    _file.flush()
+    stats.count('ledger.appends', len(lines))
+    stats.count('storage.bytes_written', len(data))
+
+async def _load_seq():
+    global _seq, _loading
+    if _loading is None:
+        _loading = asyncio.ensure_future(run_io(_last_seq))
+    last = await asyncio.shield(_loading)
+    if _seq is None:
+        _seq = last
+
+def _last_seq():
+    return max(_tail_seq(LEDGER_FILE), _tail_seq(LEDGER_ARCHIVE_FILE))
+
+# Sequence number of the last complete line, read from the end of the file.
+# A combined entry can be hundreds of KB, so the window read grows until it
+# holds a whole line.
+def _tail_seq(filename):
+    try:
+        with open(filename, 'rb') as f:
+            end = f.seek(0, os.SEEK_END)
+            window = 4096
+            while True:
+                start = max(0, end - window)
+                f.seek(start)
+                lines = f.read(end - start).splitlines()
+                if start > 0:
+                    lines = lines[1:]  # most likely the end of a longer line
+                for line in reversed(lines):
+                    try:
+                        return json.loads(line)[0]
+                    except (ValueError, IndexError, KeyError):
+                        continue
+                if start == 0:
+                    return 0
+                window *= 4
+    except FileNotFoundError:
+        return 0
+
+# Entries in the active ledger. A line cut short by a crash is skipped; the
+# compaction that follows replay drops it from the file.
+def _read_entries():
+    entries = []
+    try:
+        with open(LEDGER_FILE) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return entries
+
+async def replay():
+    global _seq
+    entries = await run_io(_read_entries)
+    last = await run_io(_last_seq)
+    _seq = max(_seq or 0, last)
+    # Grouped by the economy the balances belong to, not the server: with one
+    # economy for every server, entries from all of them are one user's
+    # history, and only the latest counts.
+    final = {}  # partition -> {user id: (wallet, bank)}
+    for entry in entries:
+        part = partition(entry[9] if len(entry) > 9 else None)
+        balances = final.setdefault(part, {})
+        if entry[2] is None:
+            balances.update(zip(entry[10], zip(entry[13], entry[14])))
+        else:
+            balances[entry[2]] = (entry[5], entry[6])
+    restored = 0
+    for part, balances in final.items():
+        changed = []
+        for user_id, (balance, bank) in balances.items():
+            user_data = await get_user_data(user_id, part)
+            if (user_data['balance'], user_data['bank']) != (balance, bank):
+                user_data['balance'], user_data['bank'] = balance, bank
+                changed.append((user_id, user_data))
+        await update_users(changed, part)
+        restored += len(changed)
+    if entries:
+        print(f'Replayed {len(entries):,} ledger entries, {restored:,} balance(s) restored.')
+    await compact()
+
+# Writes a snapshot, then archives every entry it covers. Anything appended
+# while the snapshot is written stays in the active ledger.
+@stats.timed('ledger.compact')
+async def compact():
+    covered = _seq
+    if not covered:
+        return
+    # Only economies that were opened can have changes since their last
+    # write-back.
+    for part, users in loaded_stores(ECONOMY_FILE):
+        await users.flush()
+    await run_io(_archive, covered)
+
+def _archive(covered):
+    global _file
+    try:
+        with open(LEDGER_FILE) as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return
+    old, keep = [], []
+    for line in lines:
+        try:
+            seq = json.loads(line)[0]
+        except ValueError:
+            continue
+        (old if seq <= covered else keep).append(line)
+    if not old and len(keep) == len(lines):
+        return
+    with open(LEDGER_ARCHIVE_FILE, 'a') as f:
+        f.writelines(old)
+        f.flush()
+        os.fsync(f.fileno())
+    if _file is not None:
+        _file.close()
+        _file = None
+    directory = os.path.dirname(os.path.abspath(LEDGER_FILE))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_', suffix='.jsonl')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(keep)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, LEDGER_FILE)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+async def compact_loop():
+    while True:
+        await asyncio.sleep(LEDGER_COMPACT_INTERVAL)
+        try:
+            await compact()
+        except Exception as e:
+            print(f'Failed to compact the ledger: {e}')
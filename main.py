@@ -1,30 +1,87 @@
+import asyncio
 import discord
 from discord.ext import commands
-from config import TOKEN
+from config import TOKEN, STORAGE_SOCKET
+from storage import connect, flush_all, flush_loop, evict_loop
+from cooldowns import purge_loop
+from applications import expire_loop, finish_all_hires
+from stats import dump_loop
+from ledger import replay, compact, compact_loop
+from payroll import payroll_loop
+from startup import StartupTimer, sync_commands, warm_up
+from ratelimit import AdmissionTree, get_admission
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-bot = commands.Bot(command_prefix=None, intents=intents)  # No prefix
+# A plain bot for single-process installs; launcher.py starts each worker of a
+# sharded deployment with its own slice of the shards.
+def create_bot(timer, shard_ids=None, shard_count=None):
+    if shard_ids is None:
+        bot = commands.Bot(command_prefix=None, intents=intents, tree_cls=AdmissionTree)  # No prefix
+    else:
+        bot = commands.AutoShardedBot(command_prefix=None, intents=intents, tree_cls=AdmissionTree,
+                                      shard_ids=shard_ids, shard_count=shard_count)
+    admission = get_admission(bot)
 
-async def load_cogs():
+    # Runs once, after login and before connecting. Slash commands are
+    # global, so one worker syncing them is enough; every worker watches its
+    # own event loop for overload.
+    @bot.event
+    async def setup_hook():
+        admission.start()
+        if shard_ids is not None and 0 not in shard_ids:
+            return
+        try:
+            with timer.phase('command sync'):
+                await sync_commands(bot)
+        except Exception as e:
+            print(f'Failed to sync slash commands: {e}')
+
+    @bot.event
+    async def on_ready():
+        print(f'{bot.user} has logged in!')
+        timer.ready()
+
+    return bot
+
+async def load_cogs(bot):
     await bot.load_extension("economy")
     await bot.load_extension("business")
 
-@bot.event
-async def on_ready():
-    print(f'{bot.user} has logged in!')
+async def main(shard_ids=None, shard_count=None):
+    timer = StartupTimer()
+    bot = create_bot(timer, shard_ids, shard_count)
+    if shard_ids is None:
+        with timer.phase('ledger replay'):
+            await replay()
+            await finish_all_hires()
+        loops = (flush_loop, purge_loop, expire_loop, dump_loop, compact_loop, payroll_loop, evict_loop)
+    else:
+        # Data lives in the storage daemon, which also flushes, purges, expires,
+        # runs the payroll tick and closes idle servers' economies.
+        # Workers don't dump stats either, they would overwrite each other's
+        # STATS_FILE; /stats still shows each worker's own numbers.
+        with timer.phase('storage connect'):
+            await connect(STORAGE_SOCKET)
+        loops = ()
+    # Runs while the bot logs in and connects.
+    warming = asyncio.create_task(warm_up(timer, bot, local_storage=shard_ids is None))
+    with timer.phase('cogs'):
+        await load_cogs(bot)
+    background = [asyncio.create_task(loop()) for loop in loops]
     try:
-        await bot.tree.sync()
-        print('Slash commands synced.')
-    except Exception as e:
-        print(f'Failed to sync slash commands: {e}')
-
-async def main():
-    await load_cogs()
-    await bot.start(TOKEN)
+        await bot.start(TOKEN)
+    finally:
+        warming.cancel()
+        get_admission(bot).stop()
+        for task in background:
+            task.cancel()
+        await flush_all()
+        if shard_ids is None:
+            await compact()
+        print('Data flushed.')
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
@@ -0,0 +1,82 @@
+# migrate.py
+#
+# One-shot import of the JSON data files into the SQLite database. Run it once
+# with the bot stopped, then set STORAGE_BACKEND = 'sqlite' in config.py:
+#
+#     python migrate.py
+#
+# User records are compacted on the way in (see USER_DEFAULTS in storage.py).
+# JSON installs can compact their economy file in place instead:
+#
+#     python migrate.py --compact-users
+#
+# Installs from before economies were per server keep their data in the
+# top-level files, which ECONOMY_SCOPE = 'guild' only uses for DMs. To carry
+# on in one server with that data, hand it over to the server with
+#
+#     python migrate.py --assign-guild <server id>
+#
+# or set ECONOMY_SCOPE = 'global' to keep one economy for every server.
+
+import asyncio
+import os
+import sys
+from config import (ECONOMY_FILE, BUSINESS_FILE, APPLICATIONS_FILE, COOLDOWN_FILE, ROULETTE_FILE, DATABASE_FILE,
+                    APPLICATION_ARCHIVE_FILE, LEDGER_FILE)
+from storage import load_data, save_data, open_sqlite_store, run_io, UserRecord
+from guilds import partition_path, stored_partitions
+
+DATA_FILES = (ECONOMY_FILE, BUSINESS_FILE, APPLICATIONS_FILE, COOLDOWN_FILE, ROULETTE_FILE)
+
+# Drops default fields, and users left with nothing but defaults.
+def compact_users(data):
+    compacted = {}
+    for user_id, record in data.items():
+        record = UserRecord(record).to_dict()
+        if record:
+            compacted[user_id] = record
+    return compacted
+
+# Every server's files go into that server's own database.
+async def migrate():
+    for part in stored_partitions():
+        for filename in DATA_FILES:
+            data = await run_io(load_data, partition_path(filename, part))
+            if filename == ECONOMY_FILE:
+                data = compact_users(data)
+            store = await run_io(open_sqlite_store, filename, part)
+            await store.put_many(data.items())
+            await store.flush()
+            print(f'{partition_path(filename, part)}: imported {len(data):,} records into '
+                  f'{partition_path(DATABASE_FILE, part)}')
+
+async def compact_json():
+    for part in stored_partitions():
+        path = partition_path(ECONOMY_FILE, part)
+        data = await run_io(load_data, path)
+        compacted = compact_users(data)
+        await run_io(save_data, path, compacted)
+        print(f'{path}: kept {len(compacted):,} of {len(data):,} users')
+
+# Moves the top-level data files (and database) into the server's directory.
+def assign_guild(guild_id):
+    if os.path.exists(LEDGER_FILE) and os.path.getsize(LEDGER_FILE):
+        raise SystemExit(f'{LEDGER_FILE} still has entries to replay. Start and stop the bot once first.')
+    names = [*DATA_FILES, APPLICATION_ARCHIVE_FILE, DATABASE_FILE, f'{DATABASE_FILE}-wal', f'{DATABASE_FILE}-shm']
+    moves = [(name, partition_path(name, str(guild_id))) for name in names if os.path.exists(name)]
+    taken = [target for name, target in moves if os.path.exists(target)]
+    if taken:
+        raise SystemExit(f'{", ".join(taken)} already exist; nothing was moved.')
+    for name, target in moves:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(name, target)
+        print(f'{name} -> {target}')
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if '--compact-users' in args:
+        asyncio.run(compact_json())
+    elif '--assign-guild' in args:
+        assign_guild(int(args[args.index('--assign-guild') + 1]))
+    else:
+        asyncio.run(migrate())
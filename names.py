@@ -0,0 +1,186 @@
+# names.py
+#
+# Display names for user ids, for embeds and DMs. The gateway's member and
+# user caches answer most lookups without a request; ids they don't know are
+# fetched over REST once and kept for NAME_CACHE_TTL seconds in an LRU of
+# NAME_CACHE_SIZE users. Lookups of an id that is already being fetched wait
+# for that request instead of sending another.
+#
+# Businesses keep a copy of their owner's name for /business list: their
+# nickname in the server whose economy the business belongs to, or, for the
+# top-level files (listed in every server in global mode), their account's
+# display name. Owners who rename themselves or change nickname are queued
+# (see Business.on_user_update and on_member_update) and their businesses
+# updated every NAME_REFRESH_INTERVAL seconds, in every server's economy that
+# is open; the first round to see an economy checks all of its owners, to
+# catch renames made while the bot was down or the economy was closed.
+
+import asyncio
+import time
+from collections import OrderedDict
+import discord
+import bank
+import stats
+from storage import loaded_store, loaded_stores, borrow, subscribe_evictions, unsubscribe_evictions
+from config import BUSINESS_FILE, NAME_CACHE_SIZE, NAME_CACHE_TTL, NAME_REFRESH_INTERVAL
+
+# The name a business in partition `part` shows for `user` (a User or Member).
+def owner_name(user, part):
+    if part is None:
+        return user.global_name or user.name
+    return user.display_name
+
+class NameResolver:
+    def __init__(self, bot):
+        self.bot = bot
+        self.cache = OrderedDict()  # user id -> (user or None if unknown, expires at), oldest first
+        self.fetching = {}  # user id -> future of the request in flight
+        self.renamed = set()  # users whose businesses (if any) need their owner_name updated
+        self.swept = set()  # partitions whose owners have all been checked
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._refresh_loop())
+            subscribe_evictions(self.swept.discard)
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+            unsubscribe_evictions(self.swept.discard)
+
+    # The user from the gateway cache or the LRU, without a request. Returns
+    # None when neither has them.
+    def cached_user(self, user_id, guild=None):
+        user_id = int(user_id)
+        user = (guild and guild.get_member(user_id)) or self.bot.get_user(user_id)
+        if user is not None:
+            stats.count('names.gateway_hits')
+            return user
+        entry = self.cache.get(user_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self.cache.move_to_end(user_id)
+            stats.count('names.cache_hits')
+            return entry[0]
+        return None
+
+    # The user, fetched if nothing has them cached; None if Discord doesn't
+    # know the id or the request failed.
+    async def user(self, user_id, guild=None):
+        user = self.cached_user(user_id, guild)
+        if user is not None:
+            return user
+        user_id = int(user_id)
+        entry = self.cache.get(user_id)
+        if entry is not None and entry[1] > time.monotonic():
+            return None  # known not to exist
+        fetching = self.fetching.get(user_id)
+        if fetching is None:
+            fetching = self.fetching[user_id] = asyncio.ensure_future(self._fetch(user_id))
+            fetching.add_done_callback(lambda future: self.fetching.pop(user_id, None))
+        else:
+            stats.count('names.shared_fetches')
+        return await asyncio.shield(fetching)
+
+    async def _fetch(self, user_id):
+        stats.count('names.fetches')
+        try:
+            user = await self.bot.fetch_user(user_id)
+        except discord.NotFound:
+            user = None
+        except discord.HTTPException:
+            return None  # not remembered, the next lookup tries again
+        self.cache[user_id] = (user, time.monotonic() + NAME_CACHE_TTL)
+        self.cache.move_to_end(user_id)
+        while len(self.cache) > NAME_CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return user
+
+    async def name(self, user_id, guild=None):
+        user = await self.user(user_id, guild)
+        return user.display_name if user else f"User {user_id}"
+
+    # {user_id: display name} for several users. Cached ones are answered
+    # straight away; the rest are fetched concurrently.
+    async def names(self, user_ids, guild=None):
+        found = {}
+        missing = []
+        for user_id in user_ids:
+            user = self.cached_user(user_id, guild)
+            if user is not None:
+                found[user_id] = user.display_name
+            else:
+                missing.append(user_id)
+        for user_id, name in zip(missing, await asyncio.gather(*(self.name(user_id, guild) for user_id in missing))):
+            found[user_id] = name
+        return found
+
+    def forget(self, user_id):
+        self.cache.pop(int(user_id), None)
+
+    def user_renamed(self, user_id):
+        self.forget(user_id)
+        self.renamed.add(int(user_id))
+
+    # Brings owner_name up to date for the queued owners (or, the first time
+    # an economy is seen, every owner in it) whose name the gateway cache
+    # knows. Returns how many businesses changed.
+    async def refresh_owner_names(self):
+        owner_ids, self.renamed = self.renamed, set()
+        updated = 0
+        for part, businesses in loaded_stores(BUSINESS_FILE):
+            async with borrow(part):
+                if loaded_store(BUSINESS_FILE, part) is not businesses:
+                    continue  # closed since (see storage.evict())
+                if part in self.swept:
+                    found = []
+                    for owner_id in owner_ids:
+                        found.extend(await businesses.find('owner_id', owner_id))
+                else:
+                    found = await businesses.values()
+                    self.swept.add(part)
+                updated += await self._refresh(businesses, part, found)
+        return updated
+
+    # The owner as the gateway cache knows them in partition `part`: a member
+    # of that server, or the user for the top-level files. None if not cached.
+    def _owner(self, owner_id, part):
+        if part is None:
+            return self.bot.get_user(int(owner_id))
+        guild = self.bot.get_guild(int(part))
+        return guild and guild.get_member(int(owner_id))
+
+    async def _refresh(self, businesses, part, found):
+        stale = []
+        for business in found:
+            owner = self._owner(business['owner_id'], part)
+            if owner is not None and owner_name(owner, part) != business['owner_name']:
+                stale.append(business['id'])
+        updated = 0
+        for business_id in stale:
+            async with bank.locked(businesses=[business_id]):
+                business = await businesses.get(business_id)
+                owner = business and self._owner(business['owner_id'], part)
+                if owner is not None and owner_name(owner, part) != business['owner_name']:
+                    business['owner_name'] = owner_name(owner, part)
+                    await businesses.put(business_id, business)
+                    updated += 1
+        return updated
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(NAME_REFRESH_INTERVAL)
+            try:
+                await self.refresh_owner_names()
+            except Exception as e:
+                print(f'Failed to refresh owner names: {e}')
+
+_resolver = None
+
+# The resolver shared by every cog of the bot.
+def get_names(bot):
+    global _resolver
+    if _resolver is None or _resolver.bot is not bot:
+        _resolver = NameResolver(bot)
+    return _resolver
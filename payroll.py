@@ -0,0 +1,196 @@
+# payroll.py
+#
+# The economy tick. Every PAYROLL_INTERVAL seconds each business earns
+# REVENUE_PER_LEVEL per level plus REVENUE_PER_EMPLOYEE per employee, pays each
+# employee EMPLOYEE_WAGE times its work bonus out of that, and the owner keeps
+# the rest. A business that can't cover its payroll splits its revenue evenly
+# between the staff instead. Each business's 'revenue' is what it has earned
+# so far.
+#
+# What a tick pays each user only changes when a business does, so the totals
+# are kept up to date from store changes, like the leaderboard, and a tick
+# just copies them. Users are then credited in batches, each logged as one
+# combined ledger entry, and the whole tick lands in a single write-back,
+# however many businesses there are. Each server's economy ticks on its own
+# (see guilds.py).
+
+import asyncio
+import bank
+import ledger
+import stats
+from storage import (get_store, get_user_data, update_users, user_field, known_partitions, borrow,
+                     subscribe_evictions)
+from guilds import partition
+from config import ECONOMY_FILE, BUSINESS_FILE, PAYROLL_INTERVAL, REVENUE_PER_LEVEL, REVENUE_PER_EMPLOYEE, EMPLOYEE_WAGE
+
+CREDIT_BATCH = 5000  # records per update_many; the event loop gets a turn between batches
+
+# What a business pays out each tick: (owner id, employee ids, revenue, wage).
+def payout(business):
+    staff = tuple(business['employees'])
+    revenue = REVENUE_PER_LEVEL * business['level'] + REVENUE_PER_EMPLOYEE * len(staff)
+    wage = min(int(EMPLOYEE_WAGE * business['work_bonus']), revenue // len(staff)) if staff else 0
+    return str(business['owner_id']), staff, revenue, wage
+
+class Payouts:
+    def __init__(self, businesses):
+        self.businesses = {}  # business id -> payout()
+        self.credits = {}  # user id -> what a tick pays them, from every business
+        self.total = 0  # revenue of a tick
+        for business_id, business in businesses:
+            self.update(business_id, business)
+
+    def __len__(self):
+        return len(self.businesses)
+
+    # Most changes (work sessions, names, the tick's own revenue) leave the
+    # payout as it was and stop at the comparison.
+    def update(self, business_id, business):
+        new = payout(business) if business else None
+        old = self.businesses.get(business_id)
+        if new == old:
+            return
+        if old is not None:
+            self._add(old, -1)
+        if new is None:
+            del self.businesses[business_id]
+        else:
+            self.businesses[business_id] = new
+            self._add(new, 1)
+
+    def _add(self, payout, sign):
+        owner, staff, revenue, wage = payout
+        self.total += sign * revenue
+        self._credit(owner, sign * (revenue - wage * len(staff)))
+        for user_id in staff:
+            self._credit(user_id, sign * wage)
+
+    def _credit(self, user_id, amount):
+        credit = self.credits.get(user_id, 0) + amount
+        if credit:
+            self.credits[user_id] = credit
+        else:
+            self.credits.pop(user_id, None)
+
+_payouts = {}  # partition -> Payouts
+
+async def get_payouts(guild_id=None):
+    part = partition(guild_id)
+    store = await get_store(BUSINESS_FILE, part)
+    payouts = _payouts.get(part)
+    if payouts is None:
+        businesses = await store.items()
+        # Same as the leaderboard: nothing is written between items() and
+        # subscribe(), so no change is missed.
+        payouts = _payouts.get(part)
+        if payouts is None:
+            payouts = _payouts[part] = Payouts(businesses)
+            store.subscribe(payouts.update)
+    return payouts
+
+# Worked out again at the server's next tick (see storage.evict()).
+subscribe_evictions(lambda part: _payouts.pop(part, None))
+
+# Writes update(key, record) for `keys` CREDIT_BATCH at a time with
+# update_many, leaving out the records whose lock is held (per `held`) at that
+# moment; those are returned, for the caller to update under their locks.
+# saved() runs straight after each batch, before anything else can.
+async def _update_unlocked(store, keys, held, update, saved=None):
+    busy = []
+    locked = None
+    # Called inside update_many, with nothing else running between the first
+    # call of a batch and the last, so the held locks only need checking once
+    # per batch.
+    def update_unlocked(key, record):
+        nonlocal locked
+        if locked is None:
+            locked = held()
+        if key in locked:
+            busy.append(key)
+            return None
+        return update(key, record)
+    for start in range(0, len(keys), CREDIT_BATCH):
+        locked = None
+        await store.update_many(keys[start:start + CREDIT_BATCH], update_unlocked)
+        if saved is not None:
+            await saved()
+    return busy
+
+# Runs one server's tick and returns how many businesses were paid out.
+# Crediting a few hundred thousand users one lock at a time would take
+# seconds, so records are updated in batches without locks, and the few whose
+# lock is held at that moment through the usual locked path afterwards. Each
+# batch of users is logged straight after it's saved, so no later change to
+# them can reach the ledger first.
+@stats.timed('payroll.tick')
+async def run_tick(guild_id=None):
+    payouts = await get_payouts(guild_id)
+    if not payouts:
+        return 0
+    count = len(payouts)
+    credits = dict(payouts.credits)
+    revenues = {business_id: payout[2] for business_id, payout in payouts.businesses.items()}
+    total = payouts.total
+
+    # The ledger columns of the batch being credited.
+    paid, amounts, balances, banks = [], [], [], []
+
+    def credit(user_id, record):
+        record = dict(record) if record else {}
+        amount = credits[user_id]
+        record['balance'] = user_field(record, 'balance') + amount
+        paid.append(user_id)
+        amounts.append(amount)
+        balances.append(record['balance'])
+        banks.append(user_field(record, 'bank'))
+        return record
+
+    def add_revenue(business_id, business):
+        if business is None:
+            return None
+        business = dict(business)
+        business['revenue'] = business.get('revenue', 0) + revenues[business_id]
+        return business
+
+    async def log():
+        columns = (paid[:], amounts[:], [0] * len(paid), balances[:], banks[:])
+        for column in (paid, amounts, balances, banks):
+            column.clear()
+        await ledger.record_combined(columns, 'payroll', guild_id=guild_id)
+
+    users = await get_store(ECONOMY_FILE, guild_id)
+    businesses = await get_store(BUSINESS_FILE, guild_id)
+    async with users.batch(), businesses.batch():
+        busy_users = await _update_unlocked(users, list(credits), bank.held_users, credit, log)
+        busy_businesses = await _update_unlocked(businesses, list(revenues), bank.held_businesses, add_revenue)
+        async with bank.locked(users=busy_users, businesses=busy_businesses):
+            changes = []
+            for user_id in busy_users:
+                user_data = await get_user_data(user_id, guild_id)
+                user_data['balance'] += credits[user_id]
+                changes.append((user_id, user_data))
+            await update_users(changes, guild_id)
+            await ledger.record_many([(user_id, user_data, credits[user_id], 0) for user_id, user_data in changes],
+                                     'payroll', guild_id=guild_id)
+            for business_id in busy_businesses:
+                business = await businesses.get(business_id)
+                if business:
+                    await businesses.put(business_id, add_revenue(business_id, business))
+    stats.count('payroll.revenue', total)
+    return count
+
+async def run_ticks():
+    for part in await known_partitions():
+        try:
+            async with borrow(part):
+                await run_tick(part)
+        except Exception as e:
+            print(f'Failed to run the payroll tick ({part or "top level"}): {e}')
+
+async def payroll_loop():
+    while True:
+        await asyncio.sleep(PAYROLL_INTERVAL)
+        try:
+            await run_ticks()
+        except Exception as e:
+            print(f'Failed to run the payroll tick: {e}')
@@ -0,0 +1,150 @@
+# ratelimit.py
+#
+# Admission control for slash commands. Every command belongs to a cost class
+# (COMMAND_COSTS); each class has a token bucket per user (RATE_LIMITS) and
+# one per server shared by all its members (GUILD_RATE_LIMITS), so neither one
+# spammer nor a raid can queue unbounded work on the event loop. A command
+# that finds either bucket empty is answered with an ephemeral retry-after
+# instead of being run.
+#
+# The bot also watches how late the event loop wakes up. While it lags by
+# more than OVERLOAD_LAG, commands of the OVERLOAD_SHED classes are refused
+# too. A cog can register a fallback for a command (Economy serves /top
+# pages it rendered recently) to answer refused calls more usefully.
+#
+# The check runs as the interaction_check of the bot's command tree
+# (AdmissionTree, passed to the bot as tree_cls), before the command is even
+# looked up, for every app command of every cog (hybrid commands included).
+# Buckets live in each bot process; a server's commands always reach the same
+# worker, but a user active in servers on different workers gets each
+# worker's allowance.
+
+import asyncio
+import math
+import time
+import discord
+from discord import app_commands
+import stats
+from config import RATE_LIMITS, GUILD_RATE_LIMITS, COMMAND_COSTS, OVERLOAD_LAG, OVERLOAD_SHED
+
+LAG_CHECK_INTERVAL = 1  # seconds between event loop lag measurements
+SWEEP_INTERVAL = 60  # seconds between drops of buckets that have refilled
+
+class TokenBuckets:
+    def __init__(self, limits):
+        self.limits = limits  # cost class -> (commands per minute, burst)
+        self.buckets = {}  # (cost class, id) -> (tokens, refilled at)
+
+    # Seconds until `key` has a token for `cost`, 0 if it has one now. Classes
+    # without a limit always have one.
+    def wait(self, cost, key, now):
+        limit = self.limits.get(cost)
+        if limit is None:
+            return 0
+        per_minute, burst = limit
+        tokens, refilled = self.buckets.get((cost, key), (burst, now))
+        tokens = min(burst, tokens + (now - refilled) * per_minute / 60)
+        self.buckets[(cost, key)] = (tokens, now)
+        return 0 if tokens >= 1 else (1 - tokens) * 60 / per_minute
+
+    # Only after wait() returned 0 for the same key.
+    def take(self, cost, key):
+        if cost in self.limits:
+            tokens, refilled = self.buckets[(cost, key)]
+            self.buckets[(cost, key)] = (tokens - 1, refilled)
+
+    # A full bucket is the same as no bucket, so those aren't kept.
+    def sweep(self, now):
+        for (cost, key), (tokens, refilled) in list(self.buckets.items()):
+            per_minute, burst = self.limits[cost]
+            if tokens + (now - refilled) * per_minute / 60 >= burst:
+                del self.buckets[(cost, key)]
+
+class Admission:
+    def __init__(self, bot):
+        self.bot = bot
+        self.users = TokenBuckets(RATE_LIMITS)
+        self.guilds = TokenBuckets(GUILD_RATE_LIMITS)
+        self.fallbacks = {}  # command name -> async callback(interaction), True if it answered
+        self.lag = 0.0
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._monitor())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def fallback(self, command_name, callback):
+        self.fallbacks[command_name] = callback
+
+    @property
+    def overloaded(self):
+        return self.lag > OVERLOAD_LAG
+
+    # Whether to run the command. A refused interaction has been answered
+    # here, by the command's fallback or with a retry-after.
+    async def check(self, interaction):
+        if interaction.type is not discord.InteractionType.application_command:
+            return True  # autocomplete can't be answered with a message
+        name = interaction.data['name']
+        cost = COMMAND_COSTS.get(name, 'light')
+        now = time.monotonic()
+        if self.overloaded and cost in OVERLOAD_SHED:
+            stats.count('admission.shed')
+            await self.refuse(interaction, name, "The bot is busy right now, try again in a few seconds.")
+            return False
+        wait = self.users.wait(cost, interaction.user.id, now)
+        if wait:
+            stats.count('admission.user_limited')
+            await self.refuse(interaction, name, f"You're using commands too fast, try again in {math.ceil(wait)}s.")
+            return False
+        if interaction.guild_id is not None:
+            wait = self.guilds.wait(cost, interaction.guild_id, now)
+            if wait:
+                stats.count('admission.guild_limited')
+                await self.refuse(interaction, name,
+                                  f"This server is using commands too fast, try again in {math.ceil(wait)}s.")
+                return False
+            self.guilds.take(cost, interaction.guild_id)
+        self.users.take(cost, interaction.user.id)
+        return True
+
+    async def refuse(self, interaction, name, message):
+        callback = self.fallbacks.get(name)
+        try:
+            if callback is not None and await callback(interaction):
+                stats.count('admission.fallbacks')
+                return
+            await interaction.response.send_message(message, ephemeral=True)
+        except discord.HTTPException:
+            pass  # the interaction expired; there's nobody left to tell
+
+    async def _monitor(self):
+        swept = time.monotonic()
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(LAG_CHECK_INTERVAL)
+            now = time.monotonic()
+            self.lag = now - start - LAG_CHECK_INTERVAL
+            if now - swept >= SWEEP_INTERVAL:
+                self.users.sweep(now)
+                self.guilds.sweep(now)
+                swept = now
+
+# The command tree of the bot: check() runs in front of every app command.
+class AdmissionTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction):
+        return await get_admission(self.client).check(interaction)
+
+_admission = None
+
+# The admission layer shared by the bot and its cogs.
+def get_admission(bot):
+    global _admission
+    if _admission is None or _admission.bot is not bot:
+        _admission = Admission(bot)
+    return _admission
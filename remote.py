@@ -0,0 +1,173 @@
+# remote.py
+#
+# Client side of the storage daemon (storage_server.py). In a sharded
+# deployment every worker process gets RemoteStores instead of opening the data
+# files itself; they have the same async interface as JsonStore/SqliteStore, so
+# nothing above the storage layer knows the difference.
+#
+# The protocol is one JSON object per line over a Unix socket. Requests are
+# {'id', 'op', 'file', 'guild', 'args'} and get back {'id', 'result'} or
+# {'id', 'error'}; 'guild' is the partition of the data (see guilds.py), and
+# requests made under storage.borrow() carry 'background': true. The
+# daemon also pushes {'event': 'change', 'file', 'guild', 'key', 'record'} for
+# every write to any collection, which is what keeps each worker's leaderboard,
+# listing cache and cooldowns in step with the others, and {'event': 'evict',
+# 'guild'} when it closes an idle server's economy, for workers to drop those
+# caches too (see storage.evict()).
+
+import asyncio
+import itertools
+import json
+from contextlib import asynccontextmanager
+
+# Whole collections travel as a single line (items() at startup).
+MAX_MESSAGE = 1 << 30
+
+class StorageError(Exception):
+    pass
+
+class RemoteClient:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count(1)
+        self.pending = {}  # request id -> future
+        self.stores = {}  # (filename, partition) -> RemoteStore, for change events
+        self.evicted = None  # callback(partition) for evict events
+        self.background = None  # context variable, true while a request doesn't count as use
+        self.reader_task = asyncio.create_task(self._read_loop())
+
+    @classmethod
+    async def connect(cls, path):
+        reader, writer = await asyncio.open_unix_connection(path, limit=MAX_MESSAGE)
+        return cls(reader, writer)
+
+    def _send(self, op, filename, args, guild=None):
+        if self.reader_task.done():
+            raise StorageError('not connected to the storage daemon')
+        request_id = next(self.ids)
+        future = self.pending[request_id] = asyncio.get_running_loop().create_future()
+        request = {'id': request_id, 'op': op, 'file': filename, 'guild': guild, 'args': args}
+        if self.background is not None and self.background.get():
+            request['background'] = True
+        self.writer.write(json.dumps(request).encode() + b'\n')
+        return future
+
+    async def call(self, op, filename=None, *args, guild=None):
+        return await self._send(op, filename, list(args), guild)
+
+    async def _read_loop(self):
+        try:
+            while line := await self.reader.readline():
+                message = json.loads(line)
+                if message.get('event') == 'evict':
+                    # The stores themselves hold nothing; only what was built
+                    # on them goes.
+                    for (filename, part), store in self.stores.items():
+                        if part == message['guild']:
+                            store.listeners.clear()
+                    if self.evicted is not None:
+                        self.evicted(message['guild'])
+                    continue
+                if 'event' in message:
+                    store = self.stores.get((message['file'], message['guild']))
+                    if store is not None:
+                        store._notify(message['key'], message['record'])
+                    continue
+                future = self.pending.pop(message['id'], None)
+                if future is None or future.done():
+                    continue
+                if 'error' in message:
+                    future.set_exception(StorageError(message['error']))
+                else:
+                    future.set_result(message['result'])
+                # Let the caller run before the next event is dispatched, so
+                # code that reads a collection and then subscribes (the
+                # leaderboard, cooldowns) can't miss a change in between.
+                await asyncio.sleep(0)
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(StorageError('lost connection to the storage daemon'))
+            self.pending.clear()
+            print('Lost connection to the storage daemon.')
+
+    # Record locks held in the daemon, so they exclude every worker process.
+    @asynccontextmanager
+    async def locked(self, keys):
+        future = self._send('lock', None, [keys])
+        try:
+            token = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The daemon will still grant the lock; hand it straight back.
+            future.add_done_callback(self._release_abandoned)
+            raise
+        try:
+            yield
+        finally:
+            await self.call('unlock', None, token)
+
+    def _release_abandoned(self, future):
+        if not future.cancelled() and future.exception() is None and not self.reader_task.done():
+            self._send('unlock', None, [future.result()])
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+class RemoteStore:
+    def __init__(self, client, filename, part=None):
+        self.client = client
+        self.filename = filename
+        self.part = part
+        self.listeners = []
+        client.stores[(filename, part)] = self
+
+    async def _call(self, op, *args):
+        return await self.client.call(op, self.filename, *args, guild=self.part)
+
+    async def contains(self, key):
+        return await self._call('contains', str(key))
+
+    async def get(self, key, default=None):
+        record = await self._call('get', str(key))
+        return default if record is None else record
+
+    async def put(self, key, value):
+        await self._call('put', str(key), value)
+
+    async def put_many(self, items):
+        await self._call('put_many', [[str(key), value] for key, value in items])
+
+    async def delete(self, key):
+        await self._call('delete', str(key))
+
+    # The daemon sends the change before the reply to the write that caused
+    # it, so listeners have run by the time put() returns, as with local stores.
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def _notify(self, key, record):
+        for listener in self.listeners:
+            listener(key, record)
+
+    async def find(self, column, value):
+        return await self._call('find', column, value)
+
+    async def find_prefix(self, column, prefix, limit):
+        return await self._call('find_prefix', column, prefix, limit)
+
+    async def column_values(self, column):
+        return await self._call('column_values', column)
+
+    async def values(self):
+        return await self._call('values')
+
+    async def items(self):
+        return [(key, record) for key, record in await self._call('items')]
+
+    async def warm(self, columns):
+        await self._call('warm', list(columns))
+
+    async def flush(self):
+        await self._call('flush')
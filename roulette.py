@@ -0,0 +1,209 @@
+# roulette.py
+#
+# Table-based roulette. Bets placed in a channel join that channel's open
+# round, which closes ROULETTE_ROUND_SECONDS after its first bet and is spun
+# by a single scheduled task for everyone at the table. Every bet is written
+# to ROULETTE_FILE when it is placed, so a restart can finish (or refund)
+# rounds that were still pending instead of losing the stakes; bets placed
+# while a write of the file is running share the next one. Bets go to
+# the ROULETTE_FILE of the server's own economy. In a sharded deployment each
+# worker only picks up rounds from guilds on its own shards.
+
+import asyncio
+import random
+import time
+import discord
+import bank
+import ledger
+from storage import get_store, get_user_data, update_user_data, update_users, known_partitions, borrow
+from config import ROULETTE_FILE, ROULETTE_ROUND_SECONDS, ROULETTE_REFUND_AFTER
+
+class AlreadyBetting(Exception):
+    pass
+
+class RouletteEngine:
+    def __init__(self, bot):
+        self.bot = bot
+        self.rounds = {}  # round id -> {'guild_id', 'channel_id', 'resolves_at', 'bets': {user id: (color, amount)}}
+        self.open_rounds = {}  # channel id -> round id still taking bets
+        self.tasks = set()
+        self.saving = {}  # store -> future of the flush the next bets share
+        self.flushing = {}  # store -> future of the flush running now
+
+    # Picks up rounds left over from before a restart.
+    async def start(self):
+        for part in await known_partitions():
+            if part is not None and not self._owns(int(part)):
+                continue
+            async with borrow(part):
+                bets = await (await get_store(ROULETTE_FILE, part)).values()
+            for bet in bets:
+                if self._owns(bet.get('guild_id')):
+                    self._add_bet(bet)
+        now = time.time()
+        for round_id, round_data in self.rounds.items():
+            self._schedule(round_id, refund=now - round_data['resolves_at'] > ROULETTE_REFUND_AFTER)
+
+    def _add_bet(self, bet):
+        round_data = self.rounds.setdefault(bet['round_id'], {
+            'guild_id': bet.get('guild_id'),
+            'channel_id': bet['channel_id'],
+            'resolves_at': bet['resolves_at'],
+            'bets': {},
+        })
+        round_data['bets'][bet['user_id']] = (bet['color'], bet['amount'])
+
+    # Discord puts DMs on shard 0, and bets from before guild ids were recorded
+    # are left to that worker too.
+    def _owns(self, guild_id):
+        shard_ids = getattr(self.bot, 'shard_ids', None)
+        if shard_ids is None:
+            return True
+        shard_id = 0 if guild_id is None else (guild_id >> 22) % self.bot.shard_count
+        return shard_id in shard_ids
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+
+    def _schedule(self, round_id, refund=False):
+        task = asyncio.create_task(self._run_round(round_id, refund))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run_round(self, round_id, refund):
+        delay = self.rounds[round_id]['resolves_at'] - time.time()
+        if delay > 0 and not refund:
+            await asyncio.sleep(delay)
+        try:
+            await self.resolve(round_id, refund)
+        except Exception as e:
+            print(f'Failed to resolve roulette round {round_id}: {e}')
+
+    # Returns once the bets put into `store` so far are on disk. A flush of
+    # ROULETTE_FILE rewrites every pending bet, so rather than one per bet,
+    # the bets that come in while one runs all wait for the next.
+    async def _save(self, store):
+        saving = self.saving.get(store)
+        if saving is None:
+            saving = self.saving[store] = asyncio.ensure_future(self._flush(store, self.flushing.get(store)))
+        await asyncio.shield(saving)
+
+    async def _flush(self, store, previous):
+        if previous is not None:
+            await asyncio.wait([previous])
+        flushing = self.flushing[store] = self.saving.pop(store)
+        try:
+            await store.flush()
+        finally:
+            if self.flushing.get(store) is flushing:
+                del self.flushing[store]
+
+    # Takes the stake and adds the bet to the channel's open round (opening one
+    # if needed). Returns the epoch second the round will be spun at.
+    async def place_bet(self, user_id, guild_id, channel_id, color, amount):
+        user_id = str(user_id)
+        store = await get_store(ROULETTE_FILE, guild_id)
+        async with bank.locked(users=[user_id]):
+            # Looked up in the store rather than in memory, so a bet placed
+            # through another worker process counts too.
+            if await store.find('user_id', user_id):
+                raise AlreadyBetting()
+            user_data = await get_user_data(user_id, guild_id)
+            if user_data['balance'] < amount:
+                raise bank.InsufficientFunds(user_data['balance'])
+            round_id = self.open_rounds.get(channel_id)
+            if round_id is None:
+                resolves_at = int(time.time()) + ROULETTE_ROUND_SECONDS
+                round_id = f"{channel_id}_{resolves_at}"
+                self.rounds[round_id] = {'guild_id': guild_id, 'channel_id': channel_id, 'resolves_at': resolves_at,
+                                         'bets': {}}
+                self.open_rounds[channel_id] = round_id
+                self._schedule(round_id)
+            round_data = self.rounds[round_id]
+            # The seat is taken before anything else is awaited, so a round
+            # that starts resolving from here on settles this bet too; it
+            # waits for our lock before reading the balance.
+            round_data['bets'][user_id] = (color, amount)
+            try:
+                # The bet is on disk before the stake is taken, so the stake
+                # can never be saved without the bet that refunds or pays it.
+                await store.put(f"{round_id}:{user_id}", {
+                    'round_id': round_id,
+                    'guild_id': guild_id,
+                    'channel_id': channel_id,
+                    'resolves_at': round_data['resolves_at'],
+                    'user_id': user_id,
+                    'color': color,
+                    'amount': amount,
+                })
+                await self._save(store)
+                user_data['balance'] -= amount
+                await update_user_data(user_id, user_data, guild_id)
+            except BaseException:
+                del round_data['bets'][user_id]
+                raise
+            await ledger.record(user_id, user_data, 'roulette_bet', balance=-amount, ref=round_id, guild_id=guild_id)
+            return round_data['resolves_at']
+
+    # Spins the round (or refunds every stake) and pays everyone in one batch.
+    async def resolve(self, round_id, refund=False):
+        round_data = self.rounds.pop(round_id)
+        if self.open_rounds.get(round_data['channel_id']) == round_id:
+            del self.open_rounds[round_data['channel_id']]
+        guild_id = round_data['guild_id']
+        store = await get_store(ROULETTE_FILE, guild_id)
+        winning_color = None if refund else random.choice(["red", "black"])
+        # Every bettor's lock, not just the winners': a bet still being placed
+        # holds it until its stake is taken (or its seat given back), and
+        # nobody can join the round now that it is no longer open.
+        async with bank.locked(users=list(round_data['bets'])):
+            bets = dict(round_data['bets'])
+            if refund:
+                payouts = {user_id: amount for user_id, (color, amount) in bets.items()}
+            else:
+                payouts = {user_id: amount * 2 for user_id, (color, amount) in bets.items() if color == winning_color}
+            paid = []
+            for user_id, payout in payouts.items():
+                user_data = await get_user_data(user_id, guild_id)
+                user_data['balance'] += payout
+                paid.append((user_id, user_data))
+            await update_users(paid, guild_id)
+            await ledger.record_many([(user_id, user_data, payouts[user_id], 0) for user_id, user_data in paid],
+                                     'roulette_refund' if refund else 'roulette_win', ref=round_id, guild_id=guild_id)
+            # Only the bets settled here; anything else in the file belongs to
+            # another round.
+            for user_id in bets:
+                await store.delete(f"{round_id}:{user_id}")
+            # The ledger has the payouts before the bets disappear, so a crash
+            # in between can't lose them; replay restores the balances.
+            await store.flush()
+        round_data['bets'] = bets
+        await self.announce(round_data, winning_color, payouts)
+
+    async def announce(self, round_data, winning_color, payouts):
+        channel = self.bot.get_channel(round_data['channel_id'])
+        if channel is None:
+            return
+        bets = round_data['bets']
+        if winning_color is None:
+            embed = discord.Embed(
+                title="🎰 Roulette Refunded",
+                description=f"The bot restarted before this round was spun. {len(bets):,} bet(s) were refunded.",
+                color=0x999999
+            )
+        else:
+            lines = [f"<@{user_id}> won **${payout:,}**" for user_id, payout in payouts.items()]
+            if len(lines) > 20:
+                lines = lines[:20] + [f"...and {len(lines) - 20:,} more"]
+            embed = discord.Embed(
+                title="🎰 Roulette Results",
+                description=f"The ball has chosen **{winning_color.upper()}**!\n\n"
+                            + ("\n".join(lines) if lines else "Nobody won this round."),
+                color=0xd72631 if winning_color == "red" else 0x111111
+            )
+            embed.set_footer(text=f"{len(bets):,} bet(s) • {len(payouts):,} winner(s)")
+        try:
+            await channel.send(embed=embed)
+        except discord.HTTPException:
+            pass
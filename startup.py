@@ -0,0 +1,123 @@
+# startup.py
+#
+# The steps between launching a bot process and it answering commands.
+#
+# Slash commands are synced once per process from setup_hook (on_ready also
+# fires on every reconnect), and only when the commands have changed: a hash
+# of what tree.sync() would upload is kept in COMMAND_HASH_FILE, so a restart
+# with the same code doesn't re-register anything or spend sync rate limits.
+#
+# warm_up() loads the data files, the indexes commands query, the leaderboard
+# and the cooldowns in the background while the bot logs in, so the first
+# commands don't pay for them. With an economy per server (see guilds.py) it
+# does the same for the GUILD_WARM_LIMIT largest servers the process serves,
+# once the bot is ready and knows which those are; any other server's loads
+# on its first command. Each phase's duration is printed.
+
+import asyncio
+import hashlib
+import json
+import time
+from contextlib import contextmanager
+from storage import get_store, run_io
+from leaderboard import get_leaderboard
+from cooldowns import get_cooldowns
+from config import (ECONOMY_FILE, BUSINESS_FILE, APPLICATIONS_FILE, COOLDOWN_FILE, ROULETTE_FILE,
+                    COMMAND_HASH_FILE, ECONOMY_SCOPE, GUILD_WARM_LIMIT)
+
+# Every collection, with the columns commands look records up by.
+WARM_INDEXES = {
+    ECONOMY_FILE: (),
+    BUSINESS_FILE: ('owner_id', 'name_key'),
+    APPLICATIONS_FILE: ('business_id',),
+    COOLDOWN_FILE: (),
+    ROULETTE_FILE: ('user_id',),
+}
+
+class StartupTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.ready_after = None
+        self.became_ready = asyncio.Event()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            print(f'Startup: {name} took {time.perf_counter() - start:.2f}s')
+
+    # Only the first on_ready counts; later ones are reconnects.
+    def ready(self):
+        if self.ready_after is None:
+            self.ready_after = time.perf_counter() - self.started
+            print(f'Startup: ready {self.ready_after:.2f}s after launch')
+            self.became_ready.set()
+
+def command_hash(bot):
+    payload = [command.to_dict(bot.tree) for command in bot.tree.get_commands()]
+    payload.sort(key=lambda command: (command.get('type', 1), command['name']))
+    data = json.dumps([bot.application_id, payload], sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+def _read_hash():
+    try:
+        with open(COMMAND_HASH_FILE) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def _write_hash(digest):
+    with open(COMMAND_HASH_FILE, 'w') as f:
+        f.write(digest)
+
+# Syncs the command tree if it changed since the last sync. Returns whether
+# it synced.
+async def sync_commands(bot):
+    digest = command_hash(bot)
+    if await run_io(_read_hash) == digest:
+        print('Slash commands unchanged, sync skipped.')
+        return False
+    await bot.tree.sync()
+    await run_io(_write_hash, digest)
+    print('Slash commands synced.')
+    return True
+
+# Loads every store of a server's economy and builds its indexes. The storage
+# daemon runs this for the whole deployment when there's one economy for
+# every server.
+async def warm_storage(guild_id=None):
+    for filename, columns in WARM_INDEXES.items():
+        store = await get_store(filename, guild_id)
+        await store.warm(columns)
+        await asyncio.sleep(0)  # let commands in between files
+
+# Storage (unless the daemon holds it), then the bot's own in-memory caches;
+# with an economy per server, those of its largest servers.
+async def warm_up(timer, bot, local_storage=True):
+    if ECONOMY_SCOPE != 'global':
+        await timer.became_ready.wait()
+        guilds = sorted(bot.guilds, key=lambda guild: guild.member_count or 0, reverse=True)
+        await warm_guilds(timer, guilds[:GUILD_WARM_LIMIT])
+        return
+    try:
+        with timer.phase('cache warm-up'):
+            if local_storage:
+                await warm_storage()
+            await get_leaderboard()
+            await get_cooldowns()
+    except Exception as e:
+        print(f'Failed to warm up caches: {e}')
+
+# Servers nobody turns out to use are closed again after GUILD_IDLE_TIMEOUT
+# (see storage.evict()). A sharded worker warms its servers in the daemon.
+async def warm_guilds(timer, guilds):
+    with timer.phase(f'warm-up of {len(guilds)} servers'):
+        for guild in guilds:
+            try:
+                await warm_storage(guild.id)
+                await get_leaderboard(guild.id)
+                await get_cooldowns(guild.id)
+            except Exception as e:
+                print(f'Failed to warm up server {guild.id}: {e}')
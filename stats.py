@@ -0,0 +1,94 @@
+# stats.py
+#
+# Lightweight instrumentation: latency samples per command / storage call and
+# plain counters (storage reads and writes, bytes serialized, cache hits).
+# With STATS_ENABLED off, @timed hands back the undecorated function and
+# count() returns straight away, so nothing is paid on the hot path.
+
+import asyncio
+import functools
+import threading
+import time
+from collections import Counter, deque
+from config import STATS_ENABLED, STATS_FILE, STATS_DUMP_INTERVAL, STATS_SAMPLES
+
+latencies = {}  # name -> deque of recent durations in seconds
+calls = Counter()
+counters = Counter()
+started_at = time.time()
+# Storage counters are bumped from the storage thread as well as the loop.
+_lock = threading.Lock()
+
+def record(name, seconds):
+    with _lock:
+        samples = latencies.get(name)
+        if samples is None:
+            samples = latencies[name] = deque(maxlen=STATS_SAMPLES)
+        samples.append(seconds)
+        calls[name] += 1
+
+def count(name, amount=1):
+    if not STATS_ENABLED:
+        return
+    with _lock:
+        counters[name] += amount
+
+def timed(name):
+    def decorator(func):
+        if not STATS_ENABLED:
+            return func
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    record(name, time.perf_counter() - start)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def percentiles(name):
+    samples = sorted(latencies.get(name, ()))
+    if not samples:
+        return None
+    def at(fraction):
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+    return at(0.50), at(0.95), at(0.99)
+
+def cache_hit_rate():
+    hits, misses = counters['cache.hits'], counters['cache.misses']
+    if not hits + misses:
+        return None
+    return hits / (hits + misses)
+
+def snapshot():
+    with _lock:
+        return {
+            'uptime': time.time() - started_at,
+            'latency': {name: {'calls': calls[name], 'p50': p[0], 'p95': p[1], 'p99': p[2]}
+                        for name in list(latencies) if (p := percentiles(name))},
+            'counters': dict(counters),
+            'cache_hit_rate': cache_hit_rate(),
+        }
+
+# Written like the data files: on the storage thread, through a temp file
+# renamed into place, so a crash never leaves half a dump.
+async def dump_loop():
+    from storage import run_io, save_data  # storage is instrumented through this module
+    if not STATS_ENABLED:
+        return
+    while True:
+        await asyncio.sleep(STATS_DUMP_INTERVAL)
+        try:
+            await run_io(save_data, STATS_FILE, snapshot())
+        except Exception as e:
+            print(f'Failed to dump stats: {e}')
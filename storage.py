@@ -1,8 +1,23 @@
 # storage.py
 
+import asyncio
+import bisect
+import contextvars
+import copy
 import json
-from config import ECONOMY_FILE
+import os
+import sqlite3
+import tempfile
+import time
+import stats
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from remote import RemoteClient, RemoteStore
+from guilds import partition, partition_path, stored_partitions
+from config import (ECONOMY_FILE, BUSINESS_FILE, APPLICATIONS_FILE, COOLDOWN_FILE, ROULETTE_FILE, DATABASE_FILE,
+                    STORAGE_BACKEND, FLUSH_INTERVAL, FLUSH_THRESHOLD, GUILD_IDLE_TIMEOUT)
 
+@stats.timed('storage.load_data')
 def load_data(filename):
     try:
         with open(filename, 'r') as f:
@@ -10,30 +25,859 @@ def load_data(filename):
     except FileNotFoundError:
         return {}
 
+@stats.timed('storage.save_data')
 def save_data(filename, data):
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=2)
-
-def get_user_data(user_id):
-    data = load_data(ECONOMY_FILE)
-    user_id = str(user_id)
-    if user_id not in data:
-        data[user_id] = {
-            'balance': 100,
-            'bank': 0,
-            'last_work': None,
-            'last_daily': None,
-            'last_crime': None,
-            'job': None,
-            'business_job': None,
-            'level': 1,
-            'experience': 0,
-            'last_rob': None
-        }
-        save_data(ECONOMY_FILE, data)
-    return data[user_id]
-
-def update_user_data(user_id, user_data):
-    data = load_data(ECONOMY_FILE)
-    data[str(user_id)] = user_data
-    save_data(ECONOMY_FILE, data)
+    # Write to a temp file next to the target and rename over it, so a crash
+    # mid-dump never leaves a truncated data file behind.
+    directory = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(directory, exist_ok=True)  # a server's first write-back
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+            stats.count('storage.bytes_written', f.tell())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filename)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+# Appends records to a JSON-lines file that is only ever written, never
+# loaded (resolved applications, for the record).
+@stats.timed('storage.append_records')
+def append_records(filename, records):
+    data = ''.join(json.dumps(record) + '\n' for record in records)
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with open(filename, 'a') as f:
+        f.write(data)
+    stats.count('storage.bytes_written', len(data))
+
+# Every user field and its default. Users are stored with only the fields
+# that differ from these, and a user still on all defaults isn't stored at
+# all, so looking someone up (/bal on a random member) writes nothing.
+# Defaults must be immutable.
+USER_DEFAULTS = {
+    'balance': 100,
+    'bank': 0,
+    'last_work': None,
+    'last_daily': None,
+    'last_crime': None,
+    'job': None,
+    'business_job': None,
+    'level': 1,
+    'experience': 0,
+    'last_rob': None
+}
+
+# A user as handed out by get_user_data: fixed slots instead of a dict per
+# user, read and written with the usual user_data['balance'] syntax. Slots
+# are only filled when the stored record or a command sets them; the rest
+# read as their default.
+class UserRecord:
+    __slots__ = tuple(USER_DEFAULTS)
+
+    def __init__(self, data=None):
+        if data:
+            for field, value in data.items():
+                setattr(self, field, value)
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            return USER_DEFAULTS[field]
+
+    def __setitem__(self, field, value):
+        if field not in USER_DEFAULTS:
+            raise KeyError(field)
+        setattr(self, field, value)
+
+    # The fields that differ from their defaults: what gets stored.
+    def to_dict(self):
+        data = {}
+        for field, default in USER_DEFAULTS.items():
+            value = getattr(self, field, default)
+            if value != default:
+                data[field] = value
+        return data
+
+# Reads a field from a stored (compact) user record.
+def user_field(record, field):
+    return record.get(field, USER_DEFAULTS[field])
+
+def net_worth(record):
+    return user_field(record, 'balance') + user_field(record, 'bank')
+
+# Business names are matched case-insensitively everywhere.
+def name_key(name):
+    return name.strip().casefold()
+
+# Per-collection layout. `columns` are the fields pulled out of each record
+# so they can be queried: find() filters on them, and the SQLite backend keeps
+# them as real indexed columns next to the JSON blob of the full record.
+COLLECTIONS = {
+    ECONOMY_FILE: {
+        'table': 'users',
+        'columns': {
+            'balance': lambda user: user_field(user, 'balance'),
+            'bank': lambda user: user_field(user, 'bank'),
+        },
+        'indexes': [
+            'CREATE INDEX IF NOT EXISTS users_net_worth ON users (balance + bank)',
+        ],
+    },
+    BUSINESS_FILE: {
+        'table': 'businesses',
+        'columns': {
+            'owner_id': lambda business: business['owner_id'],
+            'name_key': lambda business: name_key(business['name']),
+        },
+        'indexes': [
+            'CREATE INDEX IF NOT EXISTS businesses_owner ON businesses (owner_id)',
+            'CREATE INDEX IF NOT EXISTS businesses_name ON businesses (name_key)',
+        ],
+    },
+    APPLICATIONS_FILE: {
+        'table': 'applications',
+        'columns': {
+            'business_id': lambda app: app['business_id'],
+            'applicant_id': lambda app: app['applicant_id'],
+            'status': lambda app: app['status'],
+        },
+        'indexes': [
+            'CREATE INDEX IF NOT EXISTS applications_business_status ON applications (business_id, status)',
+            'CREATE INDEX IF NOT EXISTS applications_status ON applications (status)',
+            'CREATE INDEX IF NOT EXISTS applications_applicant ON applications (applicant_id)',
+        ],
+    },
+    COOLDOWN_FILE: {
+        'table': 'cooldowns',
+        'columns': {
+            'expires_at': lambda cooldown: cooldown['expires_at'],
+        },
+        'indexes': [
+            'CREATE INDEX IF NOT EXISTS cooldowns_expiry ON cooldowns (expires_at)',
+        ],
+    },
+    ROULETTE_FILE: {
+        'table': 'roulette_bets',
+        'columns': {
+            'round_id': lambda bet: bet['round_id'],
+            'user_id': lambda bet: bet['user_id'],
+        },
+        'indexes': [
+            'CREATE INDEX IF NOT EXISTS roulette_bets_round ON roulette_bets (round_id)',
+            'CREATE INDEX IF NOT EXISTS roulette_bets_user ON roulette_bets (user_id)',
+        ],
+    },
+}
+
+# All file and database I/O runs on this single thread, so the event loop
+# never blocks on disk and SQLite only ever sees one thread at a time. Jobs
+# run in the order they were submitted.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage')
+
+async def run_io(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+# In-memory copy of one data file. The file is read once, reads are served
+# from memory and writes only mark the record dirty. Dirty records are written
+# back by flush(), which runs on a timer (flush_loop), once FLUSH_THRESHOLD
+# records are pending, and on shutdown. Any number of puts between two flushes
+# cost a single file write. `filename` names the collection, `path` is the
+# file of the partition it holds.
+class JsonStore:
+    def __init__(self, filename, data, path=None):
+        self.filename = filename
+        self.path = path or filename
+        self.columns = COLLECTIONS.get(filename, {}).get('columns', {})
+        self.data = data
+        self.dirty = set()
+        self.listeners = []
+        self.indexes = {}  # column -> {value: set of keys}, built on first find()
+        self.sorted_values = {}  # column -> sorted index values, for find_prefix()
+        self.flush_lock = asyncio.Lock()
+        self.flush_task = None
+        self.batching = 0
+
+    @stats.timed('storage.contains')
+    async def contains(self, key):
+        return str(key) in self.data
+
+    @stats.timed('storage.get')
+    async def get(self, key, default=None):
+        stats.count('storage.reads')
+        stats.count('cache.hits')
+        record = self.data.get(str(key))
+        if record is None:
+            return default
+        return copy.deepcopy(record)
+
+    @stats.timed('storage.put')
+    async def put(self, key, value):
+        stats.count('storage.writes')
+        key = str(key)
+        old = self.data.get(key)
+        record = self.data[key] = copy.deepcopy(value)
+        self._reindex(key, old, record)
+        self._mark(key)
+        self._notify(key, record)
+
+    # Writes several records as one batch; they always land in the same flush.
+    @stats.timed('storage.put_many')
+    async def put_many(self, items):
+        keys = []
+        for key, value in items:
+            stats.count('storage.writes')
+            key = str(key)
+            old = self.data.get(key)
+            record = self.data[key] = copy.deepcopy(value)
+            self._reindex(key, old, record)
+            keys.append(key)
+            self._notify(key, record)
+        self._mark(*keys)
+
+    # Calls update(key, record) for each key (record is None if there is none)
+    # and writes back what it returns as one batch; None leaves the record as
+    # it is. Returns the keys written. Nothing else runs between a record
+    # being read and written, which is what lets the payroll tick skip the
+    # per-record locks. `update` must not modify the record it's
+    # given; what it returns is stored as is.
+    @stats.timed('storage.update_many')
+    async def update_many(self, keys, update):
+        written = []
+        for key in keys:
+            key = str(key)
+            old = self.data.get(key)
+            record = update(key, old)
+            if record is None:
+                continue
+            self.data[key] = record
+            self._reindex(key, old, record)
+            written.append(key)
+            self._notify(key, record)
+        stats.count('storage.writes', len(written))
+        self._mark(*written)
+        return written
+
+    @stats.timed('storage.delete')
+    async def delete(self, key):
+        stats.count('storage.writes')
+        key = str(key)
+        old = self.data.pop(key, None)
+        if old is not None:
+            self._reindex(key, old, None)
+            self._mark(key)
+            self._notify(key, None)
+
+    # Listeners are called as listener(key, record) after every put, and with
+    # record=None after a delete. They must not modify the record.
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def _notify(self, key, record):
+        for listener in self.listeners:
+            listener(key, record)
+
+    @stats.timed('storage.find')
+    async def find(self, column, value):
+        stats.count('storage.reads')
+        stats.count('cache.hits')
+        return [copy.deepcopy(self.data[key]) for key in self._index(column).get(value, ())]
+
+    # Records whose `column` value starts with `prefix`, in column order.
+    @stats.timed('storage.find_prefix')
+    async def find_prefix(self, column, prefix, limit):
+        values = self.sorted_values.get(column)
+        if values is None:
+            values = self.sorted_values[column] = sorted(self._index(column))
+        found = []
+        for value in values[bisect.bisect_left(values, prefix):]:
+            if not value.startswith(prefix) or len(found) >= limit:
+                break
+            found.extend((await self.find(column, value))[:limit - len(found)])
+        return found
+
+    @stats.timed('storage.column_values')
+    async def column_values(self, column):
+        return list(self._index(column))
+
+    # Builds the indexes for `columns` ahead of the first find() that needs
+    # them.
+    async def warm(self, columns):
+        for column in columns:
+            self._index(column)
+
+    def _index(self, column):
+        index = self.indexes.get(column)
+        if index is None:
+            extract = self.columns[column]
+            index = self.indexes[column] = {}
+            for key, record in self.data.items():
+                index.setdefault(extract(record), set()).add(key)
+        return index
+
+    def _reindex(self, key, old, new):
+        for column, index in self.indexes.items():
+            extract = self.columns[column]
+            old_value = None if old is None else extract(old)
+            new_value = None if new is None else extract(new)
+            if old is not None and new is not None and old_value == new_value:
+                continue
+            if old is not None:
+                keys = index[old_value]
+                keys.discard(key)
+                if not keys:
+                    del index[old_value]
+                    self.sorted_values.pop(column, None)
+            if new is not None:
+                if new_value not in index:
+                    self.sorted_values.pop(column, None)
+                index.setdefault(new_value, set()).add(key)
+
+    # values()/items() hand out the cached records themselves; callers must
+    # treat them as read-only and go through put() to change anything.
+    @stats.timed('storage.values')
+    async def values(self):
+        return list(self.data.values())
+
+    @stats.timed('storage.items')
+    async def items(self):
+        return list(self.data.items())
+
+    def _mark(self, *keys):
+        self.dirty.update(keys)
+        if len(self.dirty) >= FLUSH_THRESHOLD and self.flush_task is None and not self.batching:
+            self.flush_task = asyncio.create_task(self._threshold_flush())
+
+    # Writes made inside `async with store.batch():` don't start early
+    # write-backs; they go out together once the block ends. For bulk updates
+    # spread over several awaits, which would otherwise rewrite the whole file
+    # every FLUSH_THRESHOLD records.
+    @asynccontextmanager
+    async def batch(self):
+        self.batching += 1
+        try:
+            yield
+        finally:
+            self.batching -= 1
+            self._mark()
+
+    async def _threshold_flush(self):
+        try:
+            await self.flush()
+        finally:
+            self.flush_task = None
+
+    # Records are replaced on put, never changed in place, so a shallow copy is
+    # a consistent snapshot the storage thread can serialize while the event
+    # loop carries on. Callers that arrive while a write is running wait for it
+    # and then usually find nothing left to write.
+    @stats.timed('storage.flush')
+    async def flush(self):
+        async with self.flush_lock:
+            if not self.dirty:
+                return
+            written = self.dirty
+            self.dirty = set()
+            stats.count('storage.flushes')
+            try:
+                await run_io(save_data, self.path, dict(self.data))
+            except BaseException:
+                self.dirty |= written
+                raise
+
+_connections = {}  # partition -> its database
+
+def get_connection(part=None):
+    connection = _connections.get(part)
+    if connection is None:
+        path = partition_path(DATABASE_FILE, part)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = _connections[part] = sqlite3.connect(path, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+SQL_BATCH = 500  # keys per IN (...) lookup, under SQLite's bound parameter limit
+
+# One collection stored as a SQLite table: `id` primary key, the collection's
+# query columns, and the full record as JSON in `data`. Lookups go through
+# the primary key or a column index and run on the storage thread. Writes are
+# buffered in `pending` the same way JsonStore marks records dirty, and flush()
+# commits them in a single transaction. Reads overlay whatever is pending or
+# still being written on top of what the query returned.
+class SqliteStore:
+    def __init__(self, conn, table, columns, indexes=()):
+        self.conn = conn
+        self.table = table
+        self.columns = columns
+        self.pending = {}
+        self.writing = {}
+        self.listeners = []
+        self.flush_lock = asyncio.Lock()
+        self.flush_task = None
+        self.batching = 0
+        self._create_schema(indexes)
+
+    def _create_schema(self, indexes):
+        with self.conn:
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table} (id TEXT PRIMARY KEY, data TEXT NOT NULL)')
+            existing = {row[1] for row in self.conn.execute(f'PRAGMA table_info({self.table})')}
+            missing = [column for column in self.columns if column not in existing]
+            for column in missing:
+                self.conn.execute(f'ALTER TABLE {self.table} ADD COLUMN {column}')
+            if missing:
+                # Columns added to an existing table are backfilled from the
+                # stored records.
+                assignments = ', '.join(f'{column} = ?' for column in missing)
+                rows = self.conn.execute(f'SELECT id, data FROM {self.table}').fetchall()
+                for key, data in rows:
+                    record = json.loads(data)
+                    values = [self.columns[column](record) for column in missing]
+                    self.conn.execute(f'UPDATE {self.table} SET {assignments} WHERE id = ?', (*values, key))
+            for statement in indexes:
+                self.conn.execute(statement)
+
+    def _overlay(self):
+        if not self.writing:
+            return self.pending
+        return {**self.writing, **self.pending}
+
+    def _select(self, sql, params=()):
+        stats.count('storage.queries')
+        return self._decode(self.conn.execute(sql, params).fetchall())
+
+    @stats.timed('storage.contains')
+    async def contains(self, key):
+        return await self.get(key) is not None
+
+    @stats.timed('storage.get')
+    async def get(self, key, default=None):
+        stats.count('storage.reads')
+        key = str(key)
+        overlay = self._overlay()
+        if key in overlay:
+            stats.count('cache.hits')
+            record = overlay[key]
+            return default if record is None else copy.deepcopy(record)
+        stats.count('cache.misses')
+        rows = await run_io(self._select, f'SELECT id, data FROM {self.table} WHERE id = ?', (key,))
+        overlay = self._overlay()
+        if key in overlay:
+            record = overlay[key]
+            return default if record is None else copy.deepcopy(record)
+        return rows[0][1] if rows else default
+
+    @stats.timed('storage.put')
+    async def put(self, key, value):
+        stats.count('storage.writes')
+        key = str(key)
+        record = self.pending[key] = copy.deepcopy(value)
+        self._mark()
+        self._notify(key, record)
+
+    @stats.timed('storage.put_many')
+    async def put_many(self, items):
+        records = []
+        for key, value in items:
+            key = str(key)
+            records.append((key, copy.deepcopy(value)))
+        stats.count('storage.writes', len(records))
+        self.pending.update(records)
+        self._mark()
+        for key, record in records:
+            self._notify(key, record)
+
+    # Same as JsonStore.update_many. Records that aren't pending are read in
+    # one go first; the flush lock keeps them from going stale meanwhile, since
+    # anything written in the meantime stays in the overlay.
+    @stats.timed('storage.update_many')
+    async def update_many(self, keys, update):
+        keys = [str(key) for key in keys]
+        async with self.flush_lock:
+            missing = [key for key in keys if key not in self._overlay()]
+            stored = dict(await run_io(self._select_many, missing))
+            overlay = self._overlay()
+            written = []
+            for key in keys:
+                record = update(key, overlay[key] if key in overlay else stored.get(key))
+                if record is None:
+                    continue
+                self.pending[key] = record
+                written.append(key)
+                self._notify(key, record)
+        stats.count('storage.writes', len(written))
+        self._mark()
+        return written
+
+    def _select_many(self, keys):
+        rows = []
+        for start in range(0, len(keys), SQL_BATCH):
+            batch = keys[start:start + SQL_BATCH]
+            marks = ', '.join('?' * len(batch))
+            rows.extend(self._select(f'SELECT id, data FROM {self.table} WHERE id IN ({marks})', batch))
+        return rows
+
+    @stats.timed('storage.delete')
+    async def delete(self, key):
+        stats.count('storage.writes')
+        key = str(key)
+        self.pending[key] = None
+        self._mark()
+        self._notify(key, None)
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def _notify(self, key, record):
+        for listener in self.listeners:
+            listener(key, record)
+
+    # Drops rows the overlay replaces and adds overlay records that match.
+    def _merge(self, rows, matches):
+        overlay = self._overlay()
+        merged = [(key, record) for key, record in rows if key not in overlay]
+        merged.extend((key, copy.deepcopy(record)) for key, record in overlay.items()
+                      if record is not None and matches(record))
+        return merged
+
+    @stats.timed('storage.find')
+    async def find(self, column, value):
+        extract = self.columns[column]
+        rows = await run_io(self._select, f'SELECT id, data FROM {self.table} WHERE {column} = ?', (value,))
+        return [record for key, record in self._merge(rows, lambda record: extract(record) == value)]
+
+    @stats.timed('storage.find_prefix')
+    async def find_prefix(self, column, prefix, limit):
+        extract = self.columns[column]
+        rows = await run_io(
+            self._select,
+            f'SELECT id, data FROM {self.table} WHERE {column} >= ? AND {column} < ? ORDER BY {column} LIMIT ?',
+            (prefix, prefix + '\U0010ffff', limit))
+        found = [record for key, record in self._merge(rows, lambda record: extract(record).startswith(prefix))]
+        found.sort(key=extract)
+        return found[:limit]
+
+    @stats.timed('storage.column_values')
+    async def column_values(self, column):
+        rows = await run_io(lambda: self.conn.execute(f'SELECT DISTINCT {column} FROM {self.table}').fetchall())
+        values = {row[0] for row in rows}
+        values.update(self.columns[column](record) for record in self._overlay().values() if record is not None)
+        return list(values)
+
+    @stats.timed('storage.items')
+    async def items(self):
+        rows = await run_io(self._select, f'SELECT id, data FROM {self.table}')
+        return self._merge(rows, lambda record: True)
+
+    # Queries go through SQLite's own indexes; there is nothing to build.
+    async def warm(self, columns):
+        pass
+
+    @stats.timed('storage.values')
+    async def values(self):
+        return [record for key, record in await self.items()]
+
+    def _decode(self, rows):
+        return [(key, json.loads(data)) for key, data in rows]
+
+    def _write_row(self, key, record):
+        names = ', '.join(['id', 'data', *self.columns])
+        marks = ', '.join('?' * (len(self.columns) + 2))
+        data = json.dumps(record)
+        stats.count('storage.bytes_written', len(data))
+        values = [key, data, *(extract(record) for extract in self.columns.values())]
+        self.conn.execute(f'INSERT OR REPLACE INTO {self.table} ({names}) VALUES ({marks})', values)
+
+    def _delete_row(self, key):
+        self.conn.execute(f'DELETE FROM {self.table} WHERE id = ?', (key,))
+
+    def _write_batch(self, batch):
+        with self.conn:
+            for key, record in batch.items():
+                if record is None:
+                    self._delete_row(key)
+                else:
+                    self._write_row(key, record)
+
+    def _mark(self):
+        if len(self.pending) >= FLUSH_THRESHOLD and self.flush_task is None and not self.batching:
+            self.flush_task = asyncio.create_task(self._threshold_flush())
+
+    # Same as JsonStore.batch: the writes are committed in one transaction.
+    @asynccontextmanager
+    async def batch(self):
+        self.batching += 1
+        try:
+            yield
+        finally:
+            self.batching -= 1
+            self._mark()
+
+    async def _threshold_flush(self):
+        try:
+            await self.flush()
+        finally:
+            self.flush_task = None
+
+    @stats.timed('storage.flush')
+    async def flush(self):
+        async with self.flush_lock:
+            if not self.pending:
+                return
+            self.writing = self.pending
+            self.pending = {}
+            stats.count('storage.flushes')
+            try:
+                await run_io(self._write_batch, self.writing)
+            except BaseException:
+                self.pending = {**self.writing, **self.pending}
+                raise
+            finally:
+                self.writing = {}
+
+# Businesses keep their employees in a separate table (indexed by user) rather
+# than nested inside the business blob; records are reassembled on read.
+class SqliteBusinessStore(SqliteStore):
+    def _create_schema(self, indexes):
+        super()._create_schema(indexes)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS employees ('
+                              'business_id TEXT NOT NULL, user_id TEXT NOT NULL, data TEXT NOT NULL, '
+                              'PRIMARY KEY (business_id, user_id))')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS employees_user ON employees (user_id)')
+
+    def _decode(self, rows):
+        decoded = super()._decode(rows)
+        if not decoded:
+            return decoded
+        if len(decoded) <= 500:
+            keys = [key for key, record in decoded]
+            marks = ', '.join('?' * len(keys))
+            employee_rows = self.conn.execute(
+                f'SELECT business_id, user_id, data FROM employees WHERE business_id IN ({marks})', keys)
+        else:
+            employee_rows = self.conn.execute('SELECT business_id, user_id, data FROM employees')
+        by_business = {key: record for key, record in decoded}
+        for record in by_business.values():
+            record['employees'] = {}
+        for business_id, user_id, data in employee_rows:
+            if business_id in by_business:
+                by_business[business_id]['employees'][user_id] = json.loads(data)
+        return decoded
+
+    def _write_row(self, key, record):
+        record = dict(record)
+        employees = record.pop('employees', {})
+        super()._write_row(key, record)
+        self.conn.execute('DELETE FROM employees WHERE business_id = ?', (key,))
+        self.conn.executemany('INSERT INTO employees (business_id, user_id, data) VALUES (?, ?, ?)',
+                              [(key, user_id, json.dumps(employee)) for user_id, employee in employees.items()])
+
+    def _delete_row(self, key):
+        super()._delete_row(key)
+        self.conn.execute('DELETE FROM employees WHERE business_id = ?', (key,))
+
+# Runs on the storage thread.
+@stats.timed('storage.open_sqlite_store')
+def open_sqlite_store(filename, part=None):
+    spec = COLLECTIONS[filename]
+    store_class = SqliteBusinessStore if filename == BUSINESS_FILE else SqliteStore
+    return store_class(get_connection(part), spec['table'], spec['columns'], spec['indexes'])
+
+_client = None
+
+# Sharded workers never open data files themselves: once connected, every
+# store is a RemoteStore served by the storage daemon (storage_server.py).
+async def connect(path):
+    global _client
+    _client = await RemoteClient.connect(path)
+    _client.evicted = _forget
+    _client.background = _background
+
+def remote_client():
+    return _client
+
+async def archive(filename, records, guild_id=None):
+    if not records:
+        return
+    part = partition(guild_id)
+    if _client is not None:
+        await _client.call('archive', filename, records, guild=part)
+    else:
+        await run_io(append_records, partition_path(filename, part), records)
+
+async def open_store(filename, part):
+    if _client is not None:
+        # A server the daemon closed keeps its RemoteStores (see remote.py).
+        return _client.stores.get((filename, part)) or RemoteStore(_client, filename, part)
+    if STORAGE_BACKEND == 'sqlite':
+        return await run_io(open_sqlite_store, filename, part)
+    path = partition_path(filename, part)
+    data = await run_io(load_data, path)
+    return JsonStore(filename, data, path)
+
+_stores = {}  # (filename, partition) -> store
+_opening = {}
+
+# A server's economy stays open until nobody has used it for
+# GUILD_IDLE_TIMEOUT seconds; evict_loop() then flushes and closes it, so
+# memory and database connections follow the servers that are active rather
+# than every server the bot is in. The top-level files stay open.
+EVICT_INTERVAL = 60  # seconds between checks for idle servers
+_used = {}  # partition -> time.monotonic() of its last use
+_borrowed = {}  # partition -> background jobs working in it
+_background = contextvars.ContextVar('background', default=False)
+_evict_listeners = []
+
+# The collection `filename` of a server's economy (see guilds.py). Each store
+# is opened once; callers that ask while it is still loading share the same
+# load. Caches built on a server's stores (the leaderboard, cooldowns, ...)
+# come through here on every use too, so that counts as using the server.
+@stats.timed('storage.get_store')
+async def get_store(filename, guild_id=None):
+    key = (filename, partition(guild_id))
+    if key[1] is not None and not _background.get():
+        _used[key[1]] = time.monotonic()
+    store = _stores.get(key)
+    if store is not None:
+        return store
+    opening = _opening.get(key)
+    if opening is None:
+        opening = _opening[key] = asyncio.ensure_future(open_store(*key))
+    try:
+        store = await asyncio.shield(opening)
+    finally:
+        if opening.done():
+            _opening.pop(key, None)
+    _stores[key] = store
+    return store
+
+# (partition, store) for every open store of `filename`, without opening any.
+def loaded_stores(filename):
+    return [(part, store) for (name, part), store in list(_stores.items()) if name == filename]
+
+def loaded_store(filename, part):
+    return _stores.get((filename, part))
+
+# Every partition with data, on disk or not yet written back. Background jobs
+# that have to cover every server (the payroll tick) go through these, each
+# under borrow().
+async def known_partitions():
+    if _client is not None:
+        return await _client.call('partitions')
+    found = await run_io(stored_partitions)
+    found.extend(part for filename, part in list(_stores) if part not in found)
+    return found
+
+# Keeps server `part` open while a background job works in it, without that
+# counting as use: afterwards it is closed again unless a command used it
+# recently, so a pass over every server only has one of them open at a time.
+@asynccontextmanager
+async def borrow(part):
+    _borrowed[part] = _borrowed.get(part, 0) + 1
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+        _borrowed[part] -= 1
+        if not _borrowed[part]:
+            del _borrowed[part]
+    await evict(part)
+
+# listener(part) runs when server `part` is closed, for caches built on its
+# stores to drop theirs; they are built again on its next use.
+def subscribe_evictions(listener):
+    _evict_listeners.append(listener)
+
+def unsubscribe_evictions(listener):
+    _evict_listeners.remove(listener)
+
+def _idle(part):
+    return (part is not None and part not in _borrowed
+            and time.monotonic() - _used.get(part, float('-inf')) >= GUILD_IDLE_TIMEOUT
+            and not any(opening_part == part for filename, opening_part in _opening))
+
+def _open_stores(part):
+    return [_stores[(filename, part)] for filename in COLLECTIONS if (filename, part) in _stores]
+
+# Drops server `part`'s stores and whatever was built on them.
+def _forget(part):
+    for filename in COLLECTIONS:
+        _stores.pop((filename, part), None)
+    _used.pop(part, None)
+    for listener in list(_evict_listeners):
+        listener(part)
+
+# Flushes and closes server `part` if it is idle. Returns whether it did.
+# Sharded workers don't close anything themselves: the storage daemon tells
+# them when it has closed a server (remote.py).
+async def evict(part):
+    if _client is not None or not _idle(part):
+        return False
+    stores = _open_stores(part)
+    if not stores:
+        return False
+    for store in stores:
+        await store.flush()
+    # A command may have come in during the write-back.
+    if not _idle(part):
+        return False
+    _forget(part)
+    connection = _connections.pop(part, None)
+    if connection is not None:
+        await run_io(connection.close)
+    stats.count('storage.evictions')
+    return True
+
+async def evict_loop():
+    while True:
+        await asyncio.sleep(EVICT_INTERVAL)
+        try:
+            for part in {part for filename, part in list(_stores)}:
+                await evict(part)
+        except Exception as e:
+            print(f'Failed to close idle economies: {e}')
+
+@stats.timed('storage.flush_all')
+async def flush_all():
+    for store in list(_stores.values()):
+        await store.flush()
+
+async def flush_loop():
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        try:
+            await flush_all()
+        except Exception as e:
+            print(f'Failed to flush data: {e}')
+
+@stats.timed('storage.get_user_data')
+async def get_user_data(user_id, guild_id=None):
+    users = await get_store(ECONOMY_FILE, guild_id)
+    return UserRecord(await users.get(user_id))
+
+@stats.timed('storage.update_user_data')
+async def update_user_data(user_id, user_data, guild_id=None):
+    users = await get_store(ECONOMY_FILE, guild_id)
+    data = user_data.to_dict()
+    if data:
+        await users.put(user_id, data)
+    else:
+        await users.delete(user_id)
+
+# update_user_data for several users at once; they land in the same flush.
+@stats.timed('storage.update_users')
+async def update_users(changes, guild_id=None):
+    users = await get_store(ECONOMY_FILE, guild_id)
+    records = [(user_id, user_data.to_dict()) for user_id, user_data in changes]
+    await users.put_many([(user_id, data) for user_id, data in records if data])
+    for user_id, data in records:
+        if not data:
+            await users.delete(user_id)
@@ -0,0 +1,174 @@
+# storage_server.py
+#
+# Storage daemon for sharded deployments (see launcher.py). It is the only
+# process that opens the data files or the database: it serves the usual
+# stores to the worker processes over a Unix socket, holds the per-record
+# locks from bank.py on their behalf, and broadcasts every write so workers
+# can keep their in-memory indexes current. Write-back, the flush timer, the
+# cooldown purge, application expiry, the payroll tick, closing idle servers'
+# economies and the ledger all run here. The client side is remote.py.
+
+import asyncio
+import itertools
+import json
+import os
+import signal
+import bank
+import ledger
+from remote import MAX_MESSAGE
+from storage import (get_store, flush_all, flush_loop, evict_loop, archive, known_partitions, borrow,
+                     subscribe_evictions, unsubscribe_evictions)
+from cooldowns import purge_loop
+from applications import expire_loop, finish_all_hires
+from payroll import payroll_loop
+from startup import warm_storage
+from config import STORAGE_SOCKET, ECONOMY_SCOPE
+
+STORE_OPS = {'contains', 'get', 'put', 'put_many', 'delete', 'find', 'find_prefix', 'column_values',
+             'values', 'items', 'warm', 'flush'}
+
+class Connection:
+    def __init__(self, writer):
+        self.writer = writer
+        self.tokens = itertools.count(1)
+        self.held = {}  # lock token -> locks from bank.acquire()
+        self.tasks = set()
+
+    def send(self, message):
+        self.writer.write(json.dumps(message).encode() + b'\n')
+
+    async def lock(self, keys):
+        locks = await bank.acquire(keys)
+        token = next(self.tokens)
+        self.held[token] = locks
+        return token
+
+    def unlock(self, token):
+        bank.release(self.held.pop(token))
+
+    # A worker that goes away can't leave records locked.
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+        for locks in self.held.values():
+            bank.release(locks)
+        self.held.clear()
+        self.writer.close()
+
+class StorageServer:
+    def __init__(self, path):
+        self.path = path
+        self.connections = set()
+        self.watched = set()  # (file, partition) pairs whose writes are being broadcast
+        self.server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = await asyncio.start_unix_server(self._serve, path=self.path, limit=MAX_MESSAGE)
+        subscribe_evictions(self._evicted)
+
+    async def stop(self):
+        unsubscribe_evictions(self._evicted)
+        self.server.close()
+        for connection in list(self.connections):
+            connection.close()
+        await self.server.wait_closed()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    async def _serve(self, reader, writer):
+        connection = Connection(writer)
+        self.connections.add(connection)
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(self._handle(connection, json.loads(line)))
+                connection.tasks.add(task)
+                task.add_done_callback(connection.tasks.discard)
+        except ConnectionError:
+            pass
+        finally:
+            self.connections.discard(connection)
+            connection.close()
+
+    async def _store(self, filename, part):
+        store = await get_store(filename, part)
+        if (filename, part) not in self.watched:
+            self.watched.add((filename, part))
+            store.subscribe(lambda key, record: self._broadcast(filename, part, key, record))
+        return store
+
+    # A closed server's stores are new objects when it is next opened, so they
+    # get subscribed again, and workers drop what they built on the old ones.
+    def _evicted(self, part):
+        self.watched = {(filename, watched) for filename, watched in self.watched if watched != part}
+        line = json.dumps({'event': 'evict', 'guild': part}).encode() + b'\n'
+        for connection in self.connections:
+            connection.writer.write(line)
+
+    # Called from inside the store's put/delete, before the writer gets its
+    # reply, so every worker sees a change ahead of anything that follows it.
+    def _broadcast(self, filename, part, key, record):
+        line = json.dumps({'event': 'change', 'file': filename, 'guild': part, 'key': key,
+                           'record': record}).encode() + b'\n'
+        for connection in self.connections:
+            connection.writer.write(line)
+
+    async def _handle(self, connection, request):
+        op, filename, part, args = request['op'], request['file'], request['guild'], request['args']
+        try:
+            if op == 'lock':
+                result = await connection.lock(*args)
+            elif op == 'unlock':
+                result = connection.unlock(*args)
+            elif op == 'ledger':
+                result = await ledger.append(*args)
+            elif op == 'archive':
+                result = await archive(filename, *args, guild_id=part)
+            elif op == 'partitions':
+                result = await known_partitions()
+            elif op in STORE_OPS and request.get('background'):
+                async with borrow(part):
+                    store = await self._store(filename, part)
+                    result = await getattr(store, op)(*args)
+            elif op in STORE_OPS:
+                store = await self._store(filename, part)
+                result = await getattr(store, op)(*args)
+            else:
+                raise ValueError(f'unknown operation {op!r}')
+            message = {'id': request['id'], 'result': result}
+        except Exception as e:
+            message = {'id': request['id'], 'error': f'{type(e).__name__}: {e}'}
+        # Serialized right away: values()/items() hand back live records.
+        connection.send(message)
+
+async def serve(path=STORAGE_SOCKET):
+    await ledger.replay()
+    await finish_all_hires()
+    server = StorageServer(path)
+    await server.start()
+    print(f'Storage daemon listening on {path}')
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    # Ctrl-C reaches the whole process group; the daemon keeps serving until
+    # the launcher has let the workers flush and exit, then sends SIGTERM.
+    loop.add_signal_handler(signal.SIGINT, lambda: None)
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    loops = (flush_loop, purge_loop, expire_loop, ledger.compact_loop, payroll_loop, evict_loop)
+    background = [asyncio.create_task(loop()) for loop in loops]
+    # Workers can connect meanwhile; requests for a file still loading share
+    # the load. With an economy per server, workers warm their own servers.
+    if ECONOMY_SCOPE == 'global':
+        background.append(asyncio.create_task(warm_storage()))
+    try:
+        await stopping.wait()
+    finally:
+        for task in background:
+            task.cancel()
+        await server.stop()
+        await flush_all()
+        await ledger.compact()
+        print('Storage daemon stopped, data flushed.')
+
+if __name__ == "__main__":
+    asyncio.run(serve())
@@ -0,0 +1,68 @@
+# test_ledger.py
+#
+# Crash recovery through the ledger: entries are appended as the bot would,
+# the in-memory state is thrown away without a write-back, and replay() has to
+# bring the balances back. Run with `python -m pytest`.
+
+import asyncio
+import pytest
+import guilds
+import ledger
+import storage
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path
+    asyncio.run(_restart())
+
+# What a crash leaves behind: the files on disk and nothing else.
+async def _restart():
+    if ledger._file is not None:
+        await storage.run_io(ledger._file.close)
+    ledger._file = None
+    ledger._seq = None
+    ledger._loading = None
+    storage._stores.clear()
+
+async def _log(user_id, wallet, server_id):
+    await ledger.append([([[user_id, 0, 0, wallet, 0]], 'work', None)], server_id)
+
+async def _replay_and_read(user_id, server_ids):
+    await _restart()
+    await ledger.replay()
+    return [(await storage.get_user_data(user_id, server_id))['balance'] for server_id in server_ids]
+
+def test_global_mode_replays_latest_entry_across_servers(monkeypatch):
+    monkeypatch.setattr(guilds, 'ECONOMY_SCOPE', 'global')
+
+    async def run():
+        await _log('42', 500, '1')
+        await _log('42', 700, '2')
+        await _log('42', 600, '1')
+        return await _replay_and_read('42', ['1', '2'])
+
+    assert asyncio.run(run()) == [600, 600]
+
+def test_guild_mode_replays_each_server_on_its_own(monkeypatch):
+    monkeypatch.setattr(guilds, 'ECONOMY_SCOPE', 'guild')
+
+    async def run():
+        await _log('42', 500, '1')
+        await _log('42', 700, '2')
+        await _log('42', 600, '1')
+        return await _replay_and_read('42', ['1', '2'])
+
+    assert asyncio.run(run()) == [600, 700]
+
+def test_sequence_survives_restart_after_large_combined_entries():
+    async def run():
+        for _ in range(3):
+            users = [str(10**17 + i) for i in range(2000)]
+            columns = (users, [100] * len(users), [0] * len(users), [100] * len(users), [0] * len(users))
+            await ledger.append([(columns, 'payroll', None)], combined=True)
+        await ledger.compact()
+        await _restart()
+        return await storage.run_io(ledger._last_seq)
+
+    assert asyncio.run(run()) == 3